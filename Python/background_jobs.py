@@ -0,0 +1,56 @@
+import os
+import tempfile
+import time
+
+from dash import DiskcacheManager
+
+from callback_metrics import deliver_job_result, mark_background_request, measured_job
+
+# Heavy callbacks run as Dash background callbacks: each job executes in its own process and its
+# progress and result go through a local diskcache directory, so no Redis/Celery service is needed
+# and the Waitress thread that took the request is free again straight away. When a filter changes
+# mid-computation the browser sends the running job's id along with the new request and Dash kills
+# the superseded process.
+JOB_CACHE_DIR = os.getenv('MILV_JOB_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'milv_jobs'))
+RESULT_EXPIRE_SECONDS = int(os.getenv('MILV_JOB_RESULT_EXPIRE', 3600))
+# How often the browser polls a running job; Dash's 1s default would delay even cached results
+BACKGROUND_POLL_MS = int(os.getenv('MILV_BACKGROUND_POLL_MS', 250))
+
+# Style pair for `running=`: the progress bar only shows while a job is in flight
+PROGRESS_VISIBLE = {'width': '100%', 'visibility': 'visible'}
+PROGRESS_HIDDEN = {'width': '100%', 'visibility': 'hidden'}
+
+
+class MeasuredDiskcacheManager(DiskcacheManager):
+    # Feeds /metrics: the job times its phases in its own process and leaves them in the cache under
+    # its pid, and the poll that collects the result records them as the call (see callback_metrics)
+    def make_job_fn(self, fn, progress, key=None):
+        handle, expire = self.handle, self.expire
+
+        def publish(record):
+            handle.set(f'milv-job-metrics-{record["job"]}', record, expire=expire)
+        return super().make_job_fn(measured_job(fn, publish), progress, key)
+
+    def call_job_fn(self, key, job_fn, args, context):
+        mark_background_request('start')
+        started = time.time()
+        job = super().call_job_fn(key, job_fn, args, context)
+        self.handle.set(f'milv-job-started-{job}', started, expire=self.expire)
+        return job
+
+    def get_result(self, key, job):
+        result = super().get_result(key, job)
+        if result is not self.UNDEFINED:
+            # A result with no record of this job's run was answered from the cache
+            deliver_job_result(self.handle.pop(f'milv-job-started-{job}', None),
+                               self.handle.pop(f'milv-job-metrics-{job}', None))
+        else:
+            mark_background_request('poll')
+        return result
+
+
+def job_manager(version, cache_dir=JOB_CACHE_DIR):
+    # version() is evaluated per request, so finished results are reused from disk until the data
+    # changes; this replaces figure_cache for background callbacks, whose work happens in a child process
+    import diskcache
+    return MeasuredDiskcacheManager(diskcache.Cache(cache_dir), cache_by=[version], expire=RESULT_EXPIRE_SECONDS)
@@ -0,0 +1,311 @@
+import argparse
+import csv
+import gc
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import psutil
+
+# Synthetic-data benchmarks for the ETL stages and the dashboard callbacks.
+#   python benchmark.py --rows 10000 100000 --out bench.json
+#   python benchmark.py --rows 10000 100000 --baseline bench.json   (exit status 1 on a regression)
+# Each size gets a seeded data set in --workdir, read cold (snapshots cleared) on every run; callbacks
+# are called directly, cache decorators bypassed, with representative filter inputs.
+PYTHON_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(PYTHON_DIR)
+sys.path.insert(0, PYTHON_DIR)
+from snapshot_cache import cache_dir_for  # noqa: E402
+from source_schemas import read_source_cached  # noqa: E402
+from turnaround_dataset import iter_turnaround_dataset, write_turnaround_dataset  # noqa: E402
+from volume_loader import read_volume  # noqa: E402
+
+DEFAULT_ROWS = [10_000, 100_000]
+OPS_WORKBOOK_MAX_ROWS = 20_000  # A little over the real workbook; openpyxl is too slow to write millions of rows
+NOISE_FLOOR = {'seconds': 0.005, 'peak_mb': 16.0}
+VOLUME_DATE_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+MODALITIES = ['CT', 'MR', 'US', 'XR', 'NM', 'Mammo', 'Fluoro', 'PET']
+HOSPITALS = ['LVH', 'LVH-S', 'LVI', 'MHC', 'RMH', 'SPV', 'BHS', 'NWH', 'CHS', 'WMC']
+DEPARTMENTS = ['TX BHS', 'SPV 171 BHS', 'LVI MAGNETIC DIV', 'ER', 'INPATIENT', 'OUTPATIENT']
+RADIOLOGIST_GROUPS = ['MILV Radiologists', 'vRad', 'Teleradiology']
+OPS_CATEGORIES = {'MODALITY': ['CT SCANS', 'MRI', 'ULTRASOUND', 'X-RAY', 'MAMMOGRAPHY'],
+                  'SITE': ['LVI MAGNETIC DIV', 'LVH', 'RMH', 'MHC'],
+                  'PAYER': ['MEDICARE', 'MEDICAID', 'COMMERCIAL', 'SELF PAY']}
+OPS_EMPLOYMENT = ['Shareholder', 'Employed', 'Locum', 'Part Time']
+OPS_YEARS = {'FYTD (Q1Q2)': 0.5, 'FY24': 1.0, 'FY23': 0.95, 'FY22': 0.9}
+GENERATOR_VERSION = 2  # Bump when the extracts change, so reused ones are regenerated
+# Above-average rows as a share of productivity rows: ~95% join, and ~31% of lognormal(1.5, 1) turnaround
+# times exceed their mean. Anything far outside this means the synthetic join is broken
+ABOVE_AVERAGE_SHARE = (0.15, 0.5)
+
+
+def generate_turnaround_extracts(rows, out_dir, rng):
+    # Volume.csv (quoted, '"Volume"' preamble, 12-hour times) and Productivity_with_sections.csv,
+    # where productivity has `rows` section rows over ~0.8 * rows accessions
+    exams = max(1, int(rows * 0.8))
+    accessions = 90_000_000 + rng.permutation(exams * 2)[:exams]
+    end = pd.Timestamp('2022-07-01') + pd.to_timedelta(rng.integers(0, 2 * 365 * 86400, exams), unit='s')
+    volume = pd.DataFrame({
+        'Accession': accessions,
+        'End Date': end.strftime(VOLUME_DATE_FORMAT),
+        'Base Class': rng.choice(['Outpatient', 'Inpatient', 'Emergency'], exams),
+        'Shift Time End': '7:30AM - 5:00PM',
+        'Modality': rng.choice(MODALITIES, exams),
+        'Exam': [f"EXAM {code}" for code in rng.integers(0, 400, exams)],
+        'Department': rng.choice(DEPARTMENTS, exams),
+        'Hospital Location': rng.choice(HOSPITALS, exams),
+        'Radiologist Group': rng.choice(RADIOLOGIST_GROUPS, exams),
+    })
+    with open(os.path.join(out_dir, 'Volume.csv'), 'w', newline='') as f:
+        f.write('"Volume"\n\n')
+        volume.to_csv(f, index=False, quoting=csv.QUOTE_ALL)
+
+    # ~5% of section rows reference accessions missing from volume, ~1% finalize before the exam ends.
+    # Orphans are numbered past every volume accession so they can never join by accident
+    picks = rng.integers(0, exams, rows)
+    orphans = accessions.max() + 1 + picks
+    finalize = end[picks] + pd.to_timedelta(rng.lognormal(1.5, 1.0, rows) * 3600, unit='s')
+    early = rng.random(rows) < 0.01
+    finalize = finalize.where(~early, end[picks] - pd.Timedelta(hours=1))
+    productivity = pd.DataFrame({
+        'Accession': np.where(rng.random(rows) < 0.05, orphans, accessions[picks]),
+        'Finalize Time': finalize.strftime('%m/%d/%Y %H:%M'),
+        'Radiologist': [f"DR {code:03d}" for code in rng.integers(0, 120, rows)],
+        'Section': rng.choice(['Body', 'Neuro', 'MSK', 'Breast', 'Chest', 'IR'], rows),
+        'wRVU': rng.gamma(2.0, 0.8, rows).round(2),
+    })
+    productivity.to_csv(os.path.join(out_dir, 'Productivity_with_sections.csv'), index=False)
+
+
+def generate_ops_extracts(rows, out_dir, rng):
+    # Cleaned_Operational_Data.csv for milv.py and an alison-ops-analysisv3.xlsx-shaped workbook
+    subcategories = [(category, sub) for category, subs in OPS_CATEGORIES.items() for sub in subs]
+    doctors = max(1, rows // len(subcategories))
+    keys = [(f"DOCTOR {d:05d}, MD", category, sub) for d in range(doctors) for category, sub in subcategories][:rows]
+    ops = pd.DataFrame(keys, columns=['Dr', 'Category', 'Subcategory'])
+    employment = dict(zip(ops['Dr'].unique(), rng.choice(OPS_EMPLOYMENT, doctors)))
+    base = rng.gamma(2.0, 1500, len(ops))
+    for year, scale in OPS_YEARS.items():
+        wrvu = base * scale * rng.uniform(0.8, 1.2, len(ops))
+        cf = rng.normal(48, 4, len(ops))
+        ops[f'Total wRVU {year}'] = wrvu.round(2)
+        ops[f'Total Payments {year}'] = (wrvu * cf).round(2)
+        ops[f'Quantity {year}'] = (wrvu / 1.4).round()
+        ops[f'CF {year}'] = cf
+    ops['FY25 Employment'] = ops['Dr'].map(employment)
+    ops.to_csv(os.path.join(out_dir, 'Cleaned_Operational_Data.csv'), index=False)
+
+    # Workbook headers as exported, trailing space included
+    workbook = ops.head(OPS_WORKBOOK_MAX_ROWS).rename(columns={'FY25 Employment': 'FY25 Employment '})
+    workbook.to_excel(os.path.join(out_dir, 'alison-ops-analysisv3.xlsx'), sheet_name='alison-ops-analysis',
+                      index=False)
+    return len(workbook)
+
+
+def generate(rows, out_dir, seed=0):
+    # Extracts are reused while rows and seed match, since writing them dominates large runs
+    marker = os.path.join(out_dir, 'generated.json')
+    if os.path.exists(marker):
+        with open(marker) as f:
+            generated = json.load(f)
+        if generated == {**generated, 'rows': rows, 'seed': seed, 'version': GENERATOR_VERSION}:
+            return generated
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    generate_turnaround_extracts(rows, out_dir, rng)
+    generated = {'rows': rows, 'seed': seed, 'version': GENERATOR_VERSION, 'workbook_rows': generate_ops_extracts(rows, out_dir, rng)}
+    with open(marker, 'w') as f:
+        json.dump(generated, f)
+    return generated
+
+
+def measure(fn, repeat=1):
+    # Best wall time over `repeat` calls and the peak RSS growth seen while they ran
+    process = psutil.Process()
+    gc.collect()
+    start_rss = process.memory_info().rss
+    peak = [start_rss]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.005):
+            peak[0] = max(peak[0], process.memory_info().rss)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    timings, result = [], None
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = fn()
+            timings.append(time.perf_counter() - started)
+    finally:
+        done.set()
+        sampler.join()
+    peak[0] = max(peak[0], process.memory_info().rss)
+    return {'seconds': round(min(timings), 4), 'peak_mb': round((peak[0] - start_rss) / 2**20, 1)}, result
+
+
+def load_module(path, name):
+    # Fresh module object per size, so module-level loads are re-run against the new data
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def unwrap(callback):
+    # Skip figure_cache so a repeated call measures the work, not a cache hit
+    return getattr(callback, '__wrapped__', callback)
+
+
+def no_progress(_):
+    pass
+
+
+def bench_etl(rows, data_dir, results):
+    os.environ['MILV_DATA_DIR'] = data_dir
+    processdata = load_module(os.path.join(PYTHON_DIR, 'processdata.py'), f'bench_processdata_{rows}')
+    results['etl.read_productivity.cold'], productivity = measure(
+        lambda: read_source_cached(processdata.productivity_file, 'productivity'))
+    results['etl.read_productivity.snapshot'], productivity = measure(
+        lambda: read_source_cached(processdata.productivity_file, 'productivity'))
+    results['etl.read_volume.cold'], volume = measure(lambda: read_volume(processdata.volume_file))
+    results['etl.read_volume.snapshot'], volume = measure(lambda: read_volume(processdata.volume_file))
+    productivity['Accession'] = pd.to_numeric(productivity['Accession'], errors='coerce')
+    results['etl.merge'], merged = measure(lambda: pd.merge(productivity, volume, on='Accession', how='inner'))
+    results['etl.add_turnaround'], merged = measure(lambda: processdata.add_turnaround(merged))
+    above_average = merged[merged['Turnaround_Time_Hours'] > merged['Turnaround_Time_Hours'].mean()]
+    results['etl.write_turnaround_dataset'], _ = measure(
+        lambda: write_turnaround_dataset([above_average], processdata.above_average_dataset))
+    del productivity, volume, merged, above_average
+
+    results['etl.run_in_memory'], _ = measure(processdata.run_in_memory)
+    results['etl.run_streaming'], _ = measure(lambda: processdata.run_streaming(max(10_000, rows // 10)))
+    dataset_rows = sum(len(frame) for frame in iter_turnaround_dataset(processdata.above_average_dataset))
+    low, high = ABOVE_AVERAGE_SHARE
+    assert low * rows <= dataset_rows <= high * rows, \
+        f"{dataset_rows} above-average rows from {rows} productivity rows; expected {low:.0%}-{high:.0%}"
+    return processdata.above_average_dataset
+
+
+def bench_dashboard3(rows, dataset, results, repeat):
+    os.environ['DATA_PATH'] = dataset
+    results['dashboard3.load'], dashboard3 = measure(
+        lambda: load_module(os.path.join(PYTHON_DIR, 'dashboard3.py'), f'bench_dashboard3_{rows}'))
+    update_dashboard, update_table = unwrap(dashboard3.update_dashboard), unwrap(dashboard3.update_table)
+    first, last = dashboard3.data['Date'].min(), dashboard3.data['Date'].max()
+    ranges = {
+        'all': (str(first.date()), str(last.date()), None, None),
+        'last_30_days': (str((last - pd.Timedelta(days=30)).date()), str(last.date()), None, None),
+        'ct_one_hospital_90_days': (str((last - pd.Timedelta(days=90)).date()), str(last.date()), ['CT'], ['LVH']),
+    }
+    for name, filters in ranges.items():
+        results[f'dashboard3.update_dashboard.{name}'], _ = measure(
+            lambda: update_dashboard(no_progress, *filters), repeat)
+    results['dashboard3.update_table.sorted_page'], _ = measure(
+        lambda: update_table(*ranges['all'], 0, 10, [{'column_id': 'Turnaround_Time_Hours', 'direction': 'desc'}], ''),
+        repeat)
+    results['dashboard3.update_table.filtered_page'], _ = measure(
+        lambda: update_table(*ranges['all'], 3, 10, [], '{Modality} contains CT'), repeat)
+
+
+def bench_milv(rows, data_dir, results, repeat):
+    os.environ['MILV_OPS_CSV'] = os.path.join(data_dir, 'Cleaned_Operational_Data.csv')
+    results['milv.load'], milv = measure(lambda: load_module(os.path.join(REPO_ROOT, 'milv.py'), f'bench_milv_{rows}'))
+    update_graph = unwrap(milv.update_graph)
+    doctors = list(milv.option_hierarchy['all_doctors'][:5])
+    values = [col for col in milv.numerical_columns if col.startswith('Total')][:3]
+    results['milv.update_graph.doctors'], _ = measure(
+        lambda: update_graph(no_progress, None, doctors, None, None, values, 'Bar'), repeat)
+    results['milv.update_graph.employment'], _ = measure(
+        lambda: update_graph(no_progress, milv.option_hierarchy['employment'], None, ['MODALITY'], None, values, 'Line'),
+        repeat)
+
+    os.environ['MILV_OPS_WORKBOOK'] = os.path.join(data_dir, 'alison-ops-analysisv3.xlsx')
+    results['milv_ops_dashboard.load'], ops = measure(
+        lambda: load_module(os.path.join(REPO_ROOT, 'milv_ops_dashboard.py'), f'bench_ops_{rows}'))
+    update_graphs = unwrap(ops.update_graphs)
+    results['milv_ops_dashboard.update_graphs.providers'], _ = measure(
+        lambda: update_graphs(list(ops.providers[:5]), list(ops.categories)), repeat)
+
+
+def run(rows_list, workdir, seed=0, repeat=3):
+    report = {'meta': {'seed': seed, 'repeat': repeat, 'created': datetime.now().isoformat(timespec='seconds'),
+                       'python': platform.python_version(), 'pandas': pd.__version__,
+                       'machine': platform.machine(), 'cpus': os.cpu_count()},
+              'results': {}}
+    for rows in rows_list:
+        data_dir = os.path.join(workdir, f'rows_{rows}')
+        results = {}
+        results['generate'], generated = measure(lambda: generate(rows, data_dir, seed))
+        results['workbook_rows'] = generated['workbook_rows']
+        # Cold reads must not find snapshots left by an earlier run
+        shutil.rmtree(cache_dir_for(os.path.join(data_dir, 'Volume.csv')), ignore_errors=True)
+        dataset = bench_etl(rows, data_dir, results)
+        bench_dashboard3(rows, dataset, results, repeat)
+        bench_milv(rows, data_dir, results, repeat)
+        report['results'][str(rows)] = {'rows': rows, **results}
+        print(f"{rows} rows: " + ', '.join(f"{name} {value['seconds']:.3f}s"
+                                           for name, value in results.items() if isinstance(value, dict)), flush=True)
+        gc.collect()
+    return report
+
+
+def compare(report, baseline, tolerance):
+    # Time and memory ratios against the baseline; anything slower/bigger than 1 + tolerance is a regression
+    regressions = []
+    for rows, results in report['results'].items():
+        previous = baseline.get('results', {}).get(rows)
+        if previous is None:
+            print(f"{rows} rows: not in baseline")
+            continue
+        print(f"\n{rows + ' rows':<56}{'baseline':>10}{'current':>10}{'ratio':>8}")
+        for name, value in results.items():
+            if not isinstance(value, dict) or name == 'generate' or name not in previous:
+                continue
+            for metric, unit in [('seconds', 's'), ('peak_mb', 'MB')]:
+                old, new = previous[name][metric], value[metric]
+                # A few ms or MB either way is run-to-run noise (allocator reuse, timer jitter), not a regression
+                ratio = new / old if old > 0 else float('inf') if new > 0 else 1.0
+                flag = ''
+                if ratio > 1 + tolerance and new - old > NOISE_FLOOR[metric]:
+                    flag = '  REGRESSION'
+                    regressions.append((rows, name, metric, old, new))
+                if metric == 'seconds' or flag:
+                    print(f"  {name + ' ' + unit:<54}{old:>10.3f}{new:>10.3f}{ratio:>8.2f}{flag}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the ETL and dashboard callbacks on synthetic data.')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS,
+                        help='Productivity rows per run (10K-10M); volume and ops extracts scale with it')
+    parser.add_argument('--workdir', default=os.path.join(REPO_ROOT, '.milv_bench'),
+                        help='Where the synthetic extracts and their snapshots are written')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='Callback calls per measurement (best time is kept)')
+    parser.add_argument('--out', help='Write the results as JSON to this path')
+    parser.add_argument('--baseline', help='Compare against a previous --out file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown before flagging (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    report = run(args.rows, args.workdir, args.seed, args.repeat)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {args.out}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.tolerance:.0%}")
+            sys.exit(1)
@@ -0,0 +1,289 @@
+import contextvars
+import cProfile
+import functools
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+
+# Per-callback latency, phase split, input cardinality, payload size and cache hits for every
+# callback in an app, exposed in Prometheus text format on /metrics. Calls are measured around
+# Dash's /_dash-update-component route from Flask request hooks: the wall time covers the callback,
+# Dash's dispatch and its JSON encoding, and the payload is the response body. Phases come from the
+# shared helpers, which mark their own work with @timed(phase) (figures go through figures.build_figure);
+# time outside them counts as 'other'. Dash JSON-encodes the response inside its own callback wrapper,
+# where no helper can time it, so serialization is part of 'other' rather than a phase of its own.
+#
+# Background callbacks (background_jobs.job_manager) answer the browser with a start request and
+# then BACKGROUND_POLL_MS polls. Those are only counted, in milv_callback_background_requests_total; the poll
+# that delivers the result is recorded as the call, timed from the job's start, with the phases the
+# job measured in its own process.
+METRICS_ROUTE = '/metrics'
+UPDATE_ROUTE = '/_dash-update-component'
+PROFILE_DIR = os.getenv('MILV_PROFILE_DIR')  # Set to dump cProfile stats of slow sampled calls here
+PROFILE_SLOW_SECONDS = float(os.getenv('MILV_PROFILE_SLOW_SECONDS', 1.0))
+PROFILE_SAMPLE_RATE = float(os.getenv('MILV_PROFILE_SAMPLE_RATE', 0.1))
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PAYLOAD_BUCKETS = (1024, 10240, 102400, 1048576, 10485760)
+CARDINALITY_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+PHASES = ('filter', 'aggregate', 'figure')
+
+_current_call = contextvars.ContextVar('milv_callback_call', default=None)
+_profile_lock = threading.Lock()
+
+
+class _Call:
+    # Outermost-phase timings of one callback request; nested helpers count once
+    def __init__(self, name, cardinality):
+        self.name = name
+        self.cardinality = cardinality
+        self.phases = defaultdict(float)
+        self.active = None
+        self.cache_hit = False
+        self.profiler = None
+        self.started = time.perf_counter()
+        self.background = None  # 'start' or 'poll' for background callback requests that carry no result
+        self.job_started = None  # time.time() at which the job delivered by this poll was started
+        self.failed = False
+
+
+def timed(phase):
+    # Decorator for shared helpers: adds their time to `phase` of the callback request in progress.
+    # Outside a request (scripts, benchmarks) it only costs a context variable lookup
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            call = _current_call.get()
+            if call is None or call.active is not None:
+                return func(*args, **kwargs)
+            call.active = phase
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                call.phases[phase] += time.perf_counter() - started
+                call.active = None
+        return wrapper
+    return decorator
+
+
+def note_cache_hit():
+    # Called by figure_cache when a callback is answered from the cache
+    call = _current_call.get()
+    if call is not None:
+        call.cache_hit = True
+
+
+def mark_background_request(kind):
+    # Called by background_jobs when the request in progress starts a job ('start') or polls one ('poll')
+    call = _current_call.get()
+    if call is not None:
+        call.background = kind
+
+
+def deliver_job_result(started, record):
+    # Called by background_jobs when a poll returns a job's result: the poll becomes the call, timed
+    # from the job's start. Without the job's record the result came from the job cache
+    call = _current_call.get()
+    if call is None:
+        return
+    call.background = None
+    call.job_started = started
+    if record is None:
+        call.cache_hit = True
+        return
+    for phase, seconds in record['phases'].items():
+        call.phases[phase] += seconds
+    call.failed = call.failed or record['failed']
+
+
+def measured_job(fn, publish):
+    # Wraps a background callback for its worker process: the job gets a call of its own for @timed
+    # helpers, and publish(record) hands the phases over before Dash stores the result
+    import inspect
+    from dash.exceptions import PreventUpdate
+    if inspect.iscoroutinefunction(fn):
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        call = _Call(fn.__name__, 0)
+        token = _current_call.set(call)
+        try:
+            return fn(*args, **kwargs)
+        except PreventUpdate:
+            raise
+        except Exception:
+            call.failed = True
+            raise
+        finally:
+            _current_call.reset(token)
+            publish({'job': os.getpid(), 'phases': dict(call.phases), 'failed': call.failed})
+    return wrapper
+
+
+def _cardinality(inputs):
+    # Selected values across the inputs: list values count their items, scalars 1, empty inputs 0.
+    # Pattern-matching (ALL) inputs arrive as a list of input dicts
+    count = 0
+    for item in inputs or []:
+        if isinstance(item, list):
+            count += _cardinality(item)
+            continue
+        value = item.get('value') if isinstance(item, dict) else None
+        count += len(value) if isinstance(value, (list, tuple)) else int(value is not None and value != '')
+    return count
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.total += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.total:.6f}'
+        yield f'{name}_count{{{labels}}} {cumulative}'
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+class CallbackMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = defaultdict(lambda: _Histogram(DURATION_BUCKETS))  # (callback, phase)
+        self.payloads = defaultdict(lambda: _Histogram(PAYLOAD_BUCKETS))
+        self.cardinality = defaultdict(lambda: _Histogram(CARDINALITY_BUCKETS))
+        self.cache_hits = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.background_requests = defaultdict(int)  # (callback, 'start' | 'poll')
+
+    def record(self, call, total, payload_bytes, failed):
+        name = call.name
+        with self.lock:
+            self.durations[(name, 'total')].observe(total)
+            for phase in PHASES:
+                self.durations[(name, phase)].observe(call.phases.get(phase, 0.0))
+            self.durations[(name, 'other')].observe(max(0.0, total - sum(call.phases.values())))
+            self.cardinality[name].observe(call.cardinality)
+            if payload_bytes is not None:
+                self.payloads[name].observe(payload_bytes)
+            self.cache_hits[name] += call.cache_hit
+            self.errors[name] += failed
+
+    def record_background_request(self, call, failed):
+        with self.lock:
+            self.background_requests[(call.name, call.background)] += 1
+            self.errors[call.name] += failed
+
+    def render(self):
+        with self.lock:
+            lines = ['# HELP milv_callback_duration_seconds Callback wall time (background callbacks from job start), total and per phase',
+                     '# TYPE milv_callback_duration_seconds histogram']
+            for (name, phase), histogram in sorted(self.durations.items()):
+                lines += histogram.lines('milv_callback_duration_seconds', f'callback="{_label(name)}",phase="{phase}"')
+            lines += ['# HELP milv_callback_response_bytes Serialized callback response size',
+                      '# TYPE milv_callback_response_bytes histogram']
+            for name, histogram in sorted(self.payloads.items()):
+                lines += histogram.lines('milv_callback_response_bytes', f'callback="{_label(name)}"')
+            lines += ['# HELP milv_callback_input_cardinality Selected values across the callback inputs',
+                      '# TYPE milv_callback_input_cardinality histogram']
+            for name, histogram in sorted(self.cardinality.items()):
+                lines += histogram.lines('milv_callback_input_cardinality', f'callback="{_label(name)}"')
+            lines += ['# HELP milv_callback_cache_hits_total Calls answered from the figure cache or the background job cache',
+                      '# TYPE milv_callback_cache_hits_total counter']
+            lines += [f'milv_callback_cache_hits_total{{callback="{_label(name)}"}} {count}'
+                      for name, count in sorted(self.cache_hits.items())]
+            lines += ['# HELP milv_callback_errors_total Calls that failed with a server error (PreventUpdate excluded)',
+                      '# TYPE milv_callback_errors_total counter']
+            lines += [f'milv_callback_errors_total{{callback="{_label(name)}"}} {count}'
+                      for name, count in sorted(self.errors.items())]
+            lines += ['# HELP milv_callback_background_requests_total Background callback starts and polls, '
+                      'kept out of the duration histograms',
+                      '# TYPE milv_callback_background_requests_total counter']
+            lines += [f'milv_callback_background_requests_total{{callback="{_label(name)}",kind="{kind}"}} {count}'
+                      for (name, kind), count in sorted(self.background_requests.items())]
+        return '\n'.join(lines) + '\n'
+
+
+callback_metrics = CallbackMetrics()
+
+
+def _profile_path(name):
+    safe = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name).strip('_')[:80]
+    return os.path.join(PROFILE_DIR, f'{safe}-{time.time_ns() // 1000000}-{os.getpid()}.prof')
+
+
+def _finish(call, payload_bytes, failed):
+    total = time.perf_counter() - call.started
+    if call.profiler is not None:
+        call.profiler.disable()
+        if total >= PROFILE_SLOW_SECONDS:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            call.profiler.dump_stats(_profile_path(call.name))
+        _profile_lock.release()
+    if call.background is not None:
+        callback_metrics.record_background_request(call, failed)
+        return
+    if call.job_started is not None:
+        # Start request, job and polling up to this response, as the user waited for it
+        total = max(total, time.time() - call.job_started)
+    callback_metrics.record(call, total, payload_bytes, failed or call.failed)
+
+
+def register_metrics(app):
+    # Call once per app, like register_etags; callbacks registered before or after are all measured
+    from flask import request
+    server = app.server
+
+    @server.before_request
+    def start_callback_call():
+        if request.method != 'POST' or not request.path.endswith(UPDATE_ROUTE):
+            return
+        # Flask caches the parsed body, so Dash's own get_json does not parse it again
+        body = request.get_json(silent=True) or {}
+        call = _Call(body.get('output', 'unknown'), _cardinality(body.get('inputs')))
+        # Background callback polls carry the job's handles; job_manager upgrades the one with the result
+        if request.args.get('cacheKey') or request.args.get('job'):
+            call.background = 'poll'
+        # One sampled profile at a time; cProfile cannot profile two threads at once
+        elif PROFILE_DIR and random.random() < PROFILE_SAMPLE_RATE and _profile_lock.acquire(blocking=False):
+            call.profiler = cProfile.Profile()
+            call.profiler.enable()
+        _current_call.set(call)
+
+    @server.after_request
+    def record_callback_call(response):
+        call = _current_call.get()
+        if call is not None:
+            _current_call.set(None)
+            payload_bytes = None if response.direct_passthrough else response.calculate_content_length()
+            _finish(call, payload_bytes, response.status_code >= 500)
+        return response
+
+    @server.teardown_request
+    def drop_callback_call(exc):
+        # after_request does not run when the request fails before a response exists
+        call = _current_call.get()
+        if call is not None:
+            _current_call.set(None)
+            _finish(call, None, True)
+
+    @server.route(METRICS_ROUTE)
+    def metrics():
+        return callback_metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+    return metrics
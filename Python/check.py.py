@@ -1,9 +1,9 @@
-import pandas as pd
+import os
+from source_schemas import describe
 
-# Load the CSV files
-productivity_df = pd.read_csv('C:/Users/aliso/OneDrive/Desktop/MILV/Python/Productivity_with_sections.csv', low_memory=False)
-volume_df = pd.read_csv('C:/Users/aliso/OneDrive/Desktop/MILV/Python/Volume.csv')
+# Header-only check of the source extracts: lists their columns and what the ETL reads from them
+data_dir = os.getenv('MILV_DATA_DIR', 'C:/Users/aliso/OneDrive/Desktop/MILV/Python')
 
 # Print column names
-print("Productivity Columns:", productivity_df.columns.tolist())
-print("Volume Columns:", volume_df.columns.tolist())
+print(describe(os.path.join(data_dir, 'Productivity_with_sections.csv'), 'productivity'))
+print(describe(os.path.join(data_dir, 'Volume.csv'), 'volume'))
@@ -0,0 +1,168 @@
+import json
+import os
+
+import pandas as pd
+import plotly.express as px
+from dash import no_update
+from dash.dependencies import Input, Output, State
+
+from downsample import WEBGL_THRESHOLD
+
+# MILV_CLIENT_FILTERING=1 sends (day, modality, hospital) cells to the browser once per session;
+# date/modality/hospital filtering, the summary tiles and the charts built from them are then
+# recomputed by clientside callbacks. Raw-record views (table, export, percentiles) stay on the server.
+CLIENT_FILTERING = bool(os.getenv('MILV_CLIENT_FILTERING'))
+CELL_DIMENSIONS = ['Date', 'Modality', 'Hospital Location']
+CELL_STORE_ID = 'tat-cells'
+LABELS = {'Turnaround_Time_Hours': 'Avg Turnaround Time (Hours)'}
+
+
+def _template_figures():
+    # Empty figures the browser fills in, so client-drawn charts match the server-drawn ones
+    empty = pd.DataFrame({'Date': pd.Series(dtype='datetime64[ns]'), 'Modality': pd.Series(dtype='object'),
+                          'Turnaround_Time_Hours': pd.Series(dtype='float64')})
+    line = px.line(empty, x='Date', y='Turnaround_Time_Hours', title="Daily Average Turnaround Time", labels=LABELS)
+    heatmap = px.density_heatmap(empty, x='Date', y='Modality', z='Turnaround_Time_Hours',
+                                 color_continuous_scale='Viridis', title="Heatmap of Turnaround Times by Modality",
+                                 labels=LABELS)
+    return {'line': json.loads(line.to_json()), 'heatmap': json.loads(heatmap.to_json())}
+
+
+def cell_payload(cube, version):
+    # Columnar cells sorted by day: days run-length encoded as cells per day, modality/hospital as
+    # indexes into sorted value lists, measures rounded to the 2 decimals the tiles show.
+    # Cells without a date can never match a date range, so they are not sent.
+    cube = cube[cube['Date'].notna()]
+    cells = cube.groupby([cube[col] for col in CELL_DIMENSIONS], observed=True, dropna=False).agg(
+        {'sum': 'sum', 'count': 'sum', 'max': 'max', 'records': 'sum'}).reset_index()
+
+    payload = {'version': version, 'webgl_threshold': WEBGL_THRESHOLD, 'figures': _template_figures()}
+    day_counts = cells.groupby('Date', sort=True).size()
+    payload['day_values'] = list(day_counts.index.strftime('%Y-%m-%d'))
+    payload['day_counts'] = day_counts.tolist()
+    for col, key in [('Modality', 'modality'), ('Hospital Location', 'hospital')]:
+        # Missing modality/hospital gets code -1: counted when unfiltered, never matched by a selection
+        codes, values = pd.factorize(cells[col].astype(object), sort=True)
+        payload[key + '_values'] = list(values.astype(str))
+        payload[key] = codes.tolist()
+    payload['sum'] = cells['sum'].round(2).tolist()
+    payload['count'] = cells['count'].astype(int).tolist()
+    payload['max'] = cells['max'].round(2).astype(object).where(cells['max'].notna(), None).tolist()
+    # Rows without a turnaround time; nearly always 0, which is shorter to send than the record count
+    payload['uncounted'] = (cells['records'] - cells['count']).astype(int).tolist()
+    return payload
+
+
+def register_cell_store(app, cube, version):
+    # Same versioned-store handshake as milv.py's option hierarchy: send only when the
+    # session's copy is missing or was built from older data
+    payload = cell_payload(cube, version)
+
+    @app.callback(
+        Output(CELL_STORE_ID, 'data'),
+        [Input(CELL_STORE_ID, 'modified_timestamp')],
+        [State(CELL_STORE_ID, 'data')]
+    )
+    def sync_cells(_, stored_cells):
+        if stored_cells and stored_cells.get('version') == version:
+            return no_update
+        return payload
+
+    return sync_cells
+
+
+# Positions of the cells inside the picked date range and modality/hospital selections
+_SELECT_CELLS_JS = """
+    if (!cells) {
+        throw window.dash_clientside.PreventUpdate;
+    }
+    var start = start_date ? start_date.slice(0, 10) : null;
+    var end = end_date ? end_date.slice(0, 10) : null;
+    var dayInRange = cells.day_values.map(function(day) {
+        return (!start || day >= start) && (!end || day <= end);
+    });
+    function allowed(selected, values) {
+        if (!selected || !selected.length) {
+            return null;
+        }
+        var wanted = new Set(selected.map(String));
+        return values.map(function(value) { return wanted.has(value); });
+    }
+    var modalityAllowed = allowed(modalities, cells.modality_values);
+    var hospitalAllowed = allowed(hospitals, cells.hospital_values);
+    var selected = [], cellDay = [];
+    var i = 0;
+    cells.day_counts.forEach(function(n, day) {
+        for (var stop = i + n; i < stop; i++) {
+            if (dayInRange[day]
+                && (!modalityAllowed || modalityAllowed[cells.modality[i]])
+                && (!hospitalAllowed || hospitalAllowed[cells.hospital[i]])) {
+                selected.push(i);
+                cellDay.push(day);
+            }
+        }
+    });
+"""
+
+# Average / max / record count tiles; same formatting as cube_summary's server-side tiles
+SUMMARY_JS = """
+function(start_date, end_date, modalities, hospitals, cells) {%s
+    var total = 0, count = 0, records = 0, maximum = null;
+    selected.forEach(function(i) {
+        total += cells.sum[i];
+        count += cells.count[i];
+        records += cells.count[i] + cells.uncounted[i];
+        if (cells.max[i] !== null && (maximum === null || cells.max[i] > maximum)) {
+            maximum = cells.max[i];
+        }
+    });
+    if (!records) {
+        return ['N/A', 'N/A', 0];
+    }
+    return [count ? (total / count).toFixed(2) : 'nan', maximum === null ? 'nan' : maximum.toFixed(2), records];
+}
+""" % _SELECT_CELLS_JS
+
+# Daily average line, as cube_daily_average; long ranges are drawn with WebGL
+DAILY_AVERAGE_JS = """
+function(start_date, end_date, modalities, hospitals, cells) {%s
+    var sums = {}, counts = {};
+    selected.forEach(function(i, k) {
+        var day = cellDay[k];
+        sums[day] = (sums[day] || 0) + cells.sum[i];
+        counts[day] = (counts[day] || 0) + cells.count[i];
+    });
+    var days = Object.keys(sums).map(Number).sort(function(a, b) { return a - b; });
+    var figure = JSON.parse(JSON.stringify(cells.figures.line));
+    var trace = figure.data[0];
+    trace.x = days.map(function(day) { return cells.day_values[day]; });
+    trace.y = days.map(function(day) { return counts[day] ? sums[day] / counts[day] : null; });
+    if (trace.x.length > cells.webgl_threshold) {
+        trace.type = 'scattergl';
+    }
+    return figure;
+}
+""" % _SELECT_CELLS_JS
+
+# Modality heatmap from per-(day, modality) sums; histogram2d's sum histfunc bins them as on the server
+MODALITY_HEATMAP_JS = """
+function(start_date, end_date, modalities, hospitals, cells) {%s
+    var sums = {};
+    selected.forEach(function(i, k) {
+        var key = cellDay[k] + ':' + cells.modality[i];
+        sums[key] = (sums[key] || 0) + cells.sum[i];
+    });
+    var figure = JSON.parse(JSON.stringify(cells.figures.heatmap));
+    var trace = figure.data[0];
+    Object.keys(sums).forEach(function(key) {
+        var parts = key.split(':').map(Number);
+        if (parts[1] < 0) {
+            return;
+        }
+        trace.x.push(cells.day_values[parts[0]]);
+        trace.y.push(cells.modality_values[parts[1]]);
+        trace.z.push(sums[key]);
+    });
+    return figure;
+}
+""" % _SELECT_CELLS_JS
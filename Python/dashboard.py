@@ -1,23 +1,23 @@
-import pandas as pd
 import dash
 from dash import dcc, html
 from dash.dependencies import Input, Output
 import plotly.express as px
+from downsample import coarsen_heatmap, downsample, use_webgl
+from figures import build_figure
+from figure_cache import figure_cache, register_etags, source_version
+from callback_metrics import register_metrics
+from dashboard_data import load_dashboard, filter_mask, cube_daily_average, cube_heatmap_frame
 
 # Load data
-data_path = r'C:\Users\aliso\OneDrive\Desktop\MILV\Python\Above_Average_Turnaround.csv'
-data = pd.read_csv(data_path)
-
-# Ensure proper datetime parsing
-data['Finalize Time'] = pd.to_datetime(data['Finalize Time'])
-data['End Date'] = pd.to_datetime(data['End Date'])
-
-# Calculate additional fields
-data['Date'] = data['End Date'].dt.date
+data_path = r'C:\Users\aliso\OneDrive\Desktop\MILV\Python\Above_Average_Turnaround'
+data, tat_cube = load_dashboard(data_path)
+data_version = source_version(data_path)
 
 # Initialize the app
 app = dash.Dash(__name__)
 app.title = "Turnaround Time Dashboard"
+register_etags(app.server)
+register_metrics(app)
 
 # Layout
 app.layout = html.Div([
@@ -28,8 +28,8 @@ app.layout = html.Div([
         html.Label("Select Date Range:"),
         dcc.DatePickerRange(
             id='date-picker',
-            start_date=data['Date'].min(),
-            end_date=data['Date'].max(),
+            start_date=data['Date'].min().date(),
+            end_date=data['Date'].max().date(),
             display_format='YYYY-MM-DD'
         ),
     ], style={'margin-bottom': '20px'}),
@@ -69,14 +69,15 @@ app.layout = html.Div([
      Input('date-picker', 'end_date'),
      Input('grouping-dropdown', 'value')]
 )
+@figure_cache.cached('dashboard.update_visualizations', version=lambda: data_version)
 def update_visualizations(start_date, end_date, group_by):
-    # Filter data by date range
-    filtered_data = data[(data['Date'] >= pd.to_datetime(start_date).date()) &
-                         (data['Date'] <= pd.to_datetime(end_date).date())]
+    # Filter the pre-aggregated cube by date range
+    filtered_cube = tat_cube[filter_mask(tat_cube, start_date, end_date)]
 
-    # Heatmap
-    heatmap_fig = px.density_heatmap(
-        filtered_data,
+    # Heatmap; days are binned once there are more than fit across the chart
+    heatmap_fig = build_figure(
+        px.density_heatmap,
+        coarsen_heatmap(cube_heatmap_frame(filtered_cube, group_by), 'Date', group_by, 'Turnaround_Time_Hours'),
         x='Date',
         y=group_by,
         z='Turnaround_Time_Hours',
@@ -85,17 +86,17 @@ def update_visualizations(start_date, end_date, group_by):
         labels={'Turnaround_Time_Hours': 'Avg Turnaround Time (Hours)'}
     )
 
-    # Line Chart
-    daily_avg = filtered_data.groupby('Date')['Turnaround_Time_Hours'].mean().reset_index()
-    line_chart_fig = px.line(
-        daily_avg,
+    # Line Chart, thinned to the point budget for long date ranges
+    line_chart_fig = build_figure(
+        px.line,
+        downsample(cube_daily_average(filtered_cube), 'Date', 'Turnaround_Time_Hours'),
         x='Date',
         y='Turnaround_Time_Hours',
         title="Daily Average Turnaround Time",
         labels={'Turnaround_Time_Hours': 'Avg Turnaround Time (Hours)'}
     )
 
-    return heatmap_fig, line_chart_fig
+    return heatmap_fig, use_webgl(line_chart_fig)
 
 # Run the app
 if __name__ == '__main__':
@@ -1,21 +1,27 @@
-import pandas as pd
 import dash
 from dash import dcc, html, dash_table
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import plotly.express as px
+import numpy as np
+from filtered_export import EXPORT_FORMAT_OPTIONS, export_url, register_export_route
+from downsample import coarsen_heatmap, downsample, use_webgl
+from figures import build_figure
+from client_cube import CLIENT_FILTERING, CELL_STORE_ID, DAILY_AVERAGE_JS, register_cell_store
+from figure_cache import figure_cache, register_etags, source_version
+from callback_metrics import register_metrics
+from dashboard_data import load_dashboard, filter_mask, cube_daily_average, cube_heatmap_frame
 
 # Load data
-data_path = r'C:\Users\aliso\OneDrive\Desktop\MILV\Python\Above_Average_Turnaround.csv'
-data = pd.read_csv(data_path)
-
-# Ensure proper datetime parsing
-data['Finalize Time'] = pd.to_datetime(data['Finalize Time'])
-data['End Date'] = pd.to_datetime(data['End Date'])
-data['Date'] = data['End Date'].dt.date
+data_path = r'C:\Users\aliso\OneDrive\Desktop\MILV\Python\Above_Average_Turnaround'
+data, tat_cube = load_dashboard(data_path)
+data_version = source_version(data_path)
 
 # Initialize the app
 app = dash.Dash(__name__)
 app.title = "Enhanced Turnaround Time Dashboard"
+register_export_route(app.server, data, lambda *filters: np.flatnonzero(filter_mask(data, *filters)))
+register_etags(app.server)
+register_metrics(app)
 
 # Layout
 app.layout = html.Div([
@@ -28,8 +34,8 @@ app.layout = html.Div([
             html.Label("Select Date Range:"),
             dcc.DatePickerRange(
                 id='date-picker',
-                start_date=data['Date'].min(),
-                end_date=data['Date'].max(),
+                start_date=data['Date'].min().date(),
+                end_date=data['Date'].max().date(),
                 display_format='YYYY-MM-DD'
             ),
         ], style={'margin-bottom': '20px', 'width': '48%', 'display': 'inline-block'}),
@@ -98,15 +104,24 @@ app.layout = html.Div([
 
     # Export Button
     html.Div([
+        dcc.Dropdown(
+            id='export-format',
+            options=EXPORT_FORMAT_OPTIONS,
+            value='csv',
+            clearable=False,
+            style={'width': '160px', 'display': 'inline-block', 'vertical-align': 'middle'},
+        ),
         html.Button("Download Filtered Data", id="download-button"),
-        dcc.Download(id="download-dataframe-csv"),
+        dcc.Location(id='download-location', refresh=True),
     ], style={'text-align': 'center', 'margin-top': '20px'}),
+
+    # (day, modality, hospital) cells for browser-side filtering, filled once per session
+    dcc.Store(id=CELL_STORE_ID, storage_type='session'),
 ])
 
 # Callbacks
 @app.callback(
     [Output('heatmap', 'figure'),
-     Output('line-chart', 'figure'),
      Output('data-table', 'data')],
     [Input('date-picker', 'start_date'),
      Input('date-picker', 'end_date'),
@@ -114,20 +129,16 @@ app.layout = html.Div([
      Input('hospital-dropdown', 'value'),
      Input('grouping-dropdown', 'value')]
 )
+@figure_cache.cached('dashboard2.update_visualizations', version=lambda: data_version)
 def update_visualizations(start_date, end_date, modalities, hospitals, group_by):
-    # Filter data
-    filtered_data = data[
-        (data['Date'] >= pd.to_datetime(start_date).date()) &
-        (data['Date'] <= pd.to_datetime(end_date).date())
-    ]
-    if modalities:
-        filtered_data = filtered_data[filtered_data['Modality'].isin(modalities)]
-    if hospitals:
-        filtered_data = filtered_data[filtered_data['Hospital Location'].isin(hospitals)]
-
-    # Heatmap
-    heatmap_fig = px.density_heatmap(
-        filtered_data,
+    # The heatmap reads the pre-aggregated cube; the table still needs raw rows
+    filtered_cube = tat_cube[filter_mask(tat_cube, start_date, end_date, modalities, hospitals)]
+    filtered_data = data[filter_mask(data, start_date, end_date, modalities, hospitals)]
+
+    # Heatmap; days are binned once there are more than fit across the chart
+    heatmap_fig = build_figure(
+        px.density_heatmap,
+        coarsen_heatmap(cube_heatmap_frame(filtered_cube, group_by), 'Date', group_by, 'Turnaround_Time_Hours'),
         x='Date',
         y=group_by,
         z='Turnaround_Time_Hours',
@@ -136,44 +147,60 @@ def update_visualizations(start_date, end_date, modalities, hospitals, group_by)
         labels={'Turnaround_Time_Hours': 'Avg Turnaround Time (Hours)'}
     )
 
-    # Line Chart
-    daily_avg = filtered_data.groupby('Date')['Turnaround_Time_Hours'].mean().reset_index()
-    line_chart_fig = px.line(
-        daily_avg,
-        x='Date',
-        y='Turnaround_Time_Hours',
-        title="Daily Average Turnaround Time",
-        labels={'Turnaround_Time_Hours': 'Avg Turnaround Time (Hours)'}
-    )
-
     # Update table data
     table_data = filtered_data.to_dict('records')
 
-    return heatmap_fig, line_chart_fig, table_data
+    return heatmap_fig, table_data
+
+# Line Chart; with MILV_CLIENT_FILTERING it is recomputed in the browser from the session's cells
+if CLIENT_FILTERING:
+    register_cell_store(app, tat_cube, data_version)
+    app.clientside_callback(
+        DAILY_AVERAGE_JS,
+        Output('line-chart', 'figure'),
+        [Input('date-picker', 'start_date'),
+         Input('date-picker', 'end_date'),
+         Input('modality-dropdown', 'value'),
+         Input('hospital-dropdown', 'value'),
+         Input(CELL_STORE_ID, 'data')]
+    )
+else:
+    @app.callback(
+        Output('line-chart', 'figure'),
+        [Input('date-picker', 'start_date'),
+         Input('date-picker', 'end_date'),
+         Input('modality-dropdown', 'value'),
+         Input('hospital-dropdown', 'value')]
+    )
+    @figure_cache.cached('dashboard2.update_line_chart', version=lambda: data_version)
+    def update_line_chart(start_date, end_date, modalities, hospitals):
+        # Thinned to the point budget for long date ranges
+        filtered_cube = tat_cube[filter_mask(tat_cube, start_date, end_date, modalities, hospitals)]
+        line_chart_fig = build_figure(
+            px.line,
+            downsample(cube_daily_average(filtered_cube), 'Date', 'Turnaround_Time_Hours'),
+            x='Date',
+            y='Turnaround_Time_Hours',
+            title="Daily Average Turnaround Time",
+            labels={'Turnaround_Time_Hours': 'Avg Turnaround Time (Hours)'}
+        )
+        return use_webgl(line_chart_fig)
 
 @app.callback(
-    Output("download-dataframe-csv", "data"),
-    [Input("download-button", "n_clicks"),
-     Input('date-picker', 'start_date'),
-     Input('date-picker', 'end_date'),
-     Input('modality-dropdown', 'value'),
-     Input('hospital-dropdown', 'value')]
+    Output('download-location', 'href'),
+    [Input("download-button", "n_clicks")],
+    [State('date-picker', 'start_date'),
+     State('date-picker', 'end_date'),
+     State('modality-dropdown', 'value'),
+     State('hospital-dropdown', 'value'),
+     State('export-format', 'value')]
 )
-def download_filtered_data(n_clicks, start_date, end_date, modalities, hospitals):
+def download_filtered_data(n_clicks, start_date, end_date, modalities, hospitals, export_format):
     if n_clicks is None:
         return dash.no_update
 
-    # Filter data for export
-    filtered_data = data[
-        (data['Date'] >= pd.to_datetime(start_date).date()) &
-        (data['Date'] <= pd.to_datetime(end_date).date())
-    ]
-    if modalities:
-        filtered_data = filtered_data[filtered_data['Modality'].isin(modalities)]
-    if hospitals:
-        filtered_data = filtered_data[filtered_data['Hospital Location'].isin(hospitals)]
-
-    return dcc.send_data_frame(filtered_data.to_csv, "Filtered_Data.csv")
+    # Filtering and writing happen in the streaming export route, only when the button is clicked
+    return f"{export_url(start_date, end_date, modalities, hospitals, export_format)}&click={n_clicks}"
 
 # Run the app
 if __name__ == '__main__':
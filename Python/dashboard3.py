@@ -1,20 +1,34 @@
-import pandas as pd
+import os
 import dash
 from dash import dcc, html, dash_table
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import plotly.express as px
+from filter_index import FilterIndex
+from filtered_export import EXPORT_FORMAT_OPTIONS, export_url, register_export_route
+from downsample import coarsen_heatmap, downsample, envelope, use_webgl
+from figures import build_figure
+from client_cube import (CLIENT_FILTERING, CELL_STORE_ID, DAILY_AVERAGE_JS, MODALITY_HEATMAP_JS, SUMMARY_JS,
+                         register_cell_store)
+from background_jobs import BACKGROUND_POLL_MS, PROGRESS_HIDDEN, PROGRESS_VISIBLE, job_manager
+from figure_cache import figure_cache, register_etags, source_version
+from callback_metrics import register_metrics
+from dashboard_data import (load_dashboard, filter_mask, page_records,
+                            cube_summary, cube_daily_average, cube_heatmap_frame)
+from tat_sketch import build_sketches, sketch_quantiles, daily_quantiles
 
 # Load data
-data_path = r'C:\Users\aliso\OneDrive\Desktop\MILV\Python\Above_Average_Turnaround.csv'
-data = pd.read_csv(data_path, low_memory=False)
-data = data.loc[:, ~data.columns.str.contains('^Unnamed')]  # Drop unnecessary columns
-data['Finalize Time'] = pd.to_datetime(data['Finalize Time'])
-data['End Date'] = pd.to_datetime(data['End Date'])
-data['Date'] = data['End Date'].dt.date
+data_path = os.getenv('DATA_PATH', r'C:\Users\aliso\OneDrive\Desktop\MILV\Python\Above_Average_Turnaround')
+data, tat_cube = load_dashboard(data_path)
+data_version = source_version(data_path)
+filter_index = FilterIndex(data)
+tat_sketches = build_sketches(data)
 
 # Initialize the app
 app = dash.Dash(__name__)
 app.title = "Executive Turnaround Time Dashboard"
+register_export_route(app.server, data, filter_index.positions_for)
+register_etags(app.server)
+register_metrics(app)
 
 # Layout
 app.layout = html.Div([
@@ -38,6 +52,18 @@ app.layout = html.Div([
             html.H3("Records Filtered", style={'text-align': 'center'}),
             html.H1(id='record-count', style={'text-align': 'center', 'color': '#003366'}),
         ], className="summary-metric", style={'width': '30%', 'display': 'inline-block'}),
+        html.Div([
+            html.H3("P50 TAT (Hours)", style={'text-align': 'center'}),
+            html.H1(id='p50-tat', style={'text-align': 'center', 'color': '#003366'}),
+        ], className="summary-metric", style={'width': '30%', 'display': 'inline-block'}),
+        html.Div([
+            html.H3("P90 TAT (Hours)", style={'text-align': 'center'}),
+            html.H1(id='p90-tat', style={'text-align': 'center', 'color': '#003366'}),
+        ], className="summary-metric", style={'width': '30%', 'display': 'inline-block'}),
+        html.Div([
+            html.H3("P99 TAT (Hours)", style={'text-align': 'center'}),
+            html.H1(id='p99-tat', style={'text-align': 'center', 'color': '#003366'}),
+        ], className="summary-metric", style={'width': '30%', 'display': 'inline-block'}),
     ], style={'padding': '20px', 'background-color': '#ffffff', 'border-bottom': '1px solid #cccccc'}),
 
     # Filters Section
@@ -46,8 +72,8 @@ app.layout = html.Div([
             html.Label("Select Date Range:", style={'font-weight': 'bold'}),
             dcc.DatePickerRange(
                 id='date-picker',
-                start_date=data['Date'].min(),
-                end_date=data['Date'].max(),
+                start_date=data['Date'].min().date(),
+                end_date=data['Date'].max().date(),
                 display_format='YYYY-MM-DD',
             ),
         ], style={'margin-bottom': '20px', 'width': '48%', 'display': 'inline-block'}),
@@ -73,6 +99,9 @@ app.layout = html.Div([
         ], style={'margin-bottom': '20px', 'width': '48%', 'display': 'inline-block'}),
     ], style={'padding': '20px', 'background-color': '#f2f2f2'}),
 
+    # Progress of the background job behind the tiles and charts
+    html.Progress(id='dashboard-progress', value='0', max='5', style=PROGRESS_HIDDEN),
+
     # Visualizations Section
     html.Div([
         html.Div([
@@ -90,95 +119,171 @@ app.layout = html.Div([
             id='data-table',
             columns=[{'name': col, 'id': col} for col in data.columns],
             style_table={'overflowX': 'auto', 'margin': '20px'},
+            page_current=0,
             page_size=10,
+            page_action='custom',
+            sort_action='custom',
+            sort_mode='multi',
+            sort_by=[],
+            filter_action='custom',
+            filter_query='',
         ),
     ], style={'padding': '20px', 'background-color': '#ffffff', 'border-top': '1px solid #cccccc'}),
 
     # Export Button
     html.Div([
+        dcc.Dropdown(
+            id='export-format',
+            options=EXPORT_FORMAT_OPTIONS,
+            value='csv',
+            clearable=False,
+            style={'width': '160px', 'display': 'inline-block', 'vertical-align': 'middle'},
+        ),
         html.Button("Download Filtered Data", id="download-button", style={'background-color': '#003366', 'color': 'white'}),
-        dcc.Download(id="download-dataframe-csv"),
+        dcc.Location(id='download-location', refresh=True),
     ], style={'text-align': 'center', 'margin-top': '20px'}),
+
+    # (day, modality, hospital) cells for browser-side filtering, filled once per session
+    dcc.Store(id=CELL_STORE_ID, storage_type='session'),
 ])
 
 # Callbacks
-@app.callback(
-    [Output('avg-tat', 'children'),
-     Output('max-tat', 'children'),
-     Output('record-count', 'children'),
-     Output('heatmap', 'figure'),
-     Output('line-chart', 'figure'),
-     Output('data-table', 'data')],
-    [Input('date-picker', 'start_date'),
-     Input('date-picker', 'end_date'),
-     Input('modality-dropdown', 'value'),
-     Input('hospital-dropdown', 'value')]
-)
-def update_dashboard(start_date, end_date, modalities, hospitals):
-    # Filter data
-    filtered_data = data[
-        (data['Date'] >= pd.to_datetime(start_date).date()) &
-        (data['Date'] <= pd.to_datetime(end_date).date())
-    ]
-    if modalities:
-        filtered_data = filtered_data[filtered_data['Modality'].isin(modalities)]
-    if hospitals:
-        filtered_data = filtered_data[filtered_data['Hospital Location'].isin(hospitals)]
-
-    # Summary metrics
-    avg_tat = f"{filtered_data['Turnaround_Time_Hours'].mean():.2f}" if not filtered_data.empty else "N/A"
-    max_tat = f"{filtered_data['Turnaround_Time_Hours'].max():.2f}" if not filtered_data.empty else "N/A"
-    record_count = len(filtered_data)
-
-    # Heatmap
-    heatmap_fig = px.density_heatmap(
-        filtered_data,
-        x='Date',
-        y='Modality',
-        z='Turnaround_Time_Hours',
-        color_continuous_scale='Viridis',
-        title="Heatmap of Turnaround Times by Modality",
-        labels={'Turnaround_Time_Hours': 'Avg Turnaround Time (Hours)'},
+if CLIENT_FILTERING:
+    # Cells go to the browser once per session; tiles and charts are then recomputed there
+    register_cell_store(app, tat_cube, data_version)
+    cell_inputs = [Input('date-picker', 'start_date'),
+                   Input('date-picker', 'end_date'),
+                   Input('modality-dropdown', 'value'),
+                   Input('hospital-dropdown', 'value'),
+                   Input(CELL_STORE_ID, 'data')]
+    app.clientside_callback(
+        SUMMARY_JS,
+        [Output('avg-tat', 'children'),
+         Output('max-tat', 'children'),
+         Output('record-count', 'children')],
+        cell_inputs
     )
+    app.clientside_callback(MODALITY_HEATMAP_JS, Output('heatmap', 'figure'), cell_inputs)
+    app.clientside_callback(DAILY_AVERAGE_JS, Output('line-chart', 'figure'), cell_inputs)
 
-    # Line Chart
-    daily_avg = filtered_data.groupby('Date')['Turnaround_Time_Hours'].mean().reset_index()
-    line_chart_fig = px.line(
-        daily_avg,
-        x='Date',
-        y='Turnaround_Time_Hours',
-        title="Daily Average Turnaround Time",
-        labels={'Turnaround_Time_Hours': 'Avg Turnaround Time (Hours)'},
+    # Percentiles merge the per-cell sketches, which stay on the server
+    @app.callback(
+        [Output('p50-tat', 'children'),
+         Output('p90-tat', 'children'),
+         Output('p99-tat', 'children')],
+        [Input('date-picker', 'start_date'),
+         Input('date-picker', 'end_date'),
+         Input('modality-dropdown', 'value'),
+         Input('hospital-dropdown', 'value')]
     )
+    @figure_cache.cached('dashboard3.update_percentiles', version=lambda: data_version)
+    def update_percentiles(start_date, end_date, modalities, hospitals):
+        filtered_sketches = tat_sketches[filter_mask(tat_sketches, start_date, end_date, modalities, hospitals)]
+        percentiles = sketch_quantiles(filtered_sketches, (0.5, 0.9, 0.99))
+        return [f"{percentiles[q]:.2f}" if not filtered_sketches.empty else "N/A" for q in (0.5, 0.9, 0.99)]
+else:
+    @app.callback(
+        [Output('avg-tat', 'children'),
+         Output('max-tat', 'children'),
+         Output('record-count', 'children'),
+         Output('p50-tat', 'children'),
+         Output('p90-tat', 'children'),
+         Output('p99-tat', 'children'),
+         Output('heatmap', 'figure'),
+         Output('line-chart', 'figure')],
+        [Input('date-picker', 'start_date'),
+         Input('date-picker', 'end_date'),
+         Input('modality-dropdown', 'value'),
+         Input('hospital-dropdown', 'value')],
+        # Long date ranges run in a worker process; a newer filter change cancels the running job
+        background=True,
+        interval=BACKGROUND_POLL_MS,
+        manager=job_manager(lambda: data_version),
+        running=[(Output('dashboard-progress', 'style'), PROGRESS_VISIBLE, PROGRESS_HIDDEN)],
+        progress=[Output('dashboard-progress', 'value'), Output('dashboard-progress', 'max')],
+    )
+    def update_dashboard(set_progress, start_date, end_date, modalities, hospitals):
+        # Filter the pre-aggregated cube; raw rows are only needed by the table and export
+        filtered_cube = tat_cube[filter_mask(tat_cube, start_date, end_date, modalities, hospitals)]
+
+        # Summary metrics
+        average, maximum, record_count = cube_summary(filtered_cube)
+        avg_tat = f"{average:.2f}" if record_count else "N/A"
+        max_tat = f"{maximum:.2f}" if record_count else "N/A"
+        set_progress(('1', '5'))
+
+        # Percentiles come from merging the selected cells' sketches
+        filtered_sketches = tat_sketches[filter_mask(tat_sketches, start_date, end_date, modalities, hospitals)]
+        percentiles = sketch_quantiles(filtered_sketches, (0.5, 0.9, 0.99))
+        p50_tat, p90_tat, p99_tat = (f"{percentiles[q]:.2f}" if record_count else "N/A" for q in (0.5, 0.9, 0.99))
+        set_progress(('2', '5'))
 
-    # Update table data
-    table_data = filtered_data.to_dict('records')
+        # Heatmap; days are binned once there are more than fit across the chart
+        heatmap_fig = build_figure(
+            px.density_heatmap,
+            coarsen_heatmap(cube_heatmap_frame(filtered_cube, 'Modality'), 'Date', 'Modality', 'Turnaround_Time_Hours'),
+            x='Date',
+            y='Modality',
+            z='Turnaround_Time_Hours',
+            color_continuous_scale='Viridis',
+            title="Heatmap of Turnaround Times by Modality",
+            labels={'Turnaround_Time_Hours': 'Avg Turnaround Time (Hours)'},
+        )
+        set_progress(('3', '5'))
 
-    return avg_tat, max_tat, record_count, heatmap_fig, line_chart_fig, table_data
+        # Line Chart, thinned to the point budget for long date ranges
+        line_chart_fig = build_figure(
+            px.line,
+            downsample(cube_daily_average(filtered_cube), 'Date', 'Turnaround_Time_Hours'),
+            x='Date',
+            y='Turnaround_Time_Hours',
+            title="Daily Average Turnaround Time",
+            labels={'Turnaround_Time_Hours': 'Avg Turnaround Time (Hours)'},
+        )
+        set_progress(('4', '5'))
+        # P10-P90 band behind the daily average
+        band = envelope(daily_quantiles(filtered_sketches, (0.1, 0.9)), 'Date', 0.1, 0.9)
+        build_figure(line_chart_fig.add_scatter, x=band['Date'], y=band[0.9], mode='lines', line={'width': 0},
+                     name='P90', showlegend=False, hoverinfo='skip')
+        build_figure(line_chart_fig.add_scatter, x=band['Date'], y=band[0.1], mode='lines', line={'width': 0},
+                     fill='tonexty', fillcolor='rgba(0, 51, 102, 0.15)', name='P10-P90')
+
+        return avg_tat, max_tat, record_count, p50_tat, p90_tat, p99_tat, heatmap_fig, use_webgl(line_chart_fig)
 
 @app.callback(
-    Output("download-dataframe-csv", "data"),
-    [Input("download-button", "n_clicks"),
-     Input('date-picker', 'start_date'),
+    [Output('data-table', 'data'),
+     Output('data-table', 'page_count')],
+    [Input('date-picker', 'start_date'),
      Input('date-picker', 'end_date'),
      Input('modality-dropdown', 'value'),
-     Input('hospital-dropdown', 'value')]
+     Input('hospital-dropdown', 'value'),
+     Input('data-table', 'page_current'),
+     Input('data-table', 'page_size'),
+     Input('data-table', 'sort_by'),
+     Input('data-table', 'filter_query')]
+)
+@figure_cache.cached('dashboard3.update_table', version=lambda: data_version)
+def update_table(start_date, end_date, modalities, hospitals, page_current, page_size, sort_by, filter_query):
+    # Only the visible page is copied and sent to the browser, however many records match
+    positions = filter_index.table_positions(start_date, end_date, modalities, hospitals,
+                                             filter_query=filter_query, sort_by=sort_by)
+    return page_records(filter_index.data, positions, page_current, page_size)
+
+@app.callback(
+    Output('download-location', 'href'),
+    [Input("download-button", "n_clicks")],
+    [State('date-picker', 'start_date'),
+     State('date-picker', 'end_date'),
+     State('modality-dropdown', 'value'),
+     State('hospital-dropdown', 'value'),
+     State('export-format', 'value')]
 )
-def download_filtered_data(n_clicks, start_date, end_date, modalities, hospitals):
+def download_filtered_data(n_clicks, start_date, end_date, modalities, hospitals, export_format):
     if n_clicks is None:
         return dash.no_update
 
-    # Filter data for export
-    filtered_data = data[
-        (data['Date'] >= pd.to_datetime(start_date).date()) &
-        (data['Date'] <= pd.to_datetime(end_date).date())
-    ]
-    if modalities:
-        filtered_data = filtered_data[filtered_data['Modality'].isin(modalities)]
-    if hospitals:
-        filtered_data = filtered_data[filtered_data['Hospital Location'].isin(hospitals)]
-
-    return dcc.send_data_frame(filtered_data.to_csv, "Filtered_Data.csv")
+    # Filtering and writing happen in the streaming export route, only when the button is clicked
+    return f"{export_url(start_date, end_date, modalities, hospitals, export_format)}&click={n_clicks}"
 
 # Run the app
 if __name__ == '__main__':
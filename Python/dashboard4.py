@@ -1,43 +1,95 @@
-import dash
-from dash import dcc, html, dash_table
-from dash.dependencies import Input, Output
-import plotly.express as px
-import pandas as pd
 import os
+import sys
+import threading
+import time
+
+import dash
+import psutil
+from dash import dcc, html
+
+# Startup is timed from process start, so interpreter start-up and the imports above count too.
+# Dash (which imports plotly) stays eager: app.server has to exist before Waitress can bind and
+# gunicorn imports dashboard4:server. pandas and the data layer are only imported by the loader thread.
+started = time.perf_counter() - (time.time() - psutil.Process().create_time())
 
 # Load data
-data_path = os.getenv('DATA_PATH', 'Above_Average_Turnaround.csv')  # Default to local file if env var not set
-data = pd.read_csv(data_path, low_memory=False)
-data = data.loc[:, ~data.columns.str.contains('^Unnamed')]  # Drop unnecessary columns
-data['Finalize Time'] = pd.to_datetime(data['Finalize Time'])
-data['End Date'] = pd.to_datetime(data['End Date'])
-data['Date'] = data['End Date'].dt.date
+data_path = os.getenv('DATA_PATH', 'Above_Average_Turnaround')  # Default to local file if env var not set
+data = None
+data_ready = threading.Event()
+
+
+def load_data():
+    # Runs off the request path so the port is bound before the CSV/snapshot is read
+    global data
+    from dashboard_data import load_dashboard_data, load_shared_dashboard_data
+    # MILV_SHARED_DATA=1 (multi-worker gunicorn) maps one Arrow copy of the data into every worker
+    if os.getenv('MILV_SHARED_DATA'):
+        data = load_shared_dashboard_data(data_path)
+    else:
+        data = load_dashboard_data(data_path)
+    data_ready.set()
+    print(f"Data ready {time.perf_counter() - started:.2f}s after start ({len(data)} rows)", flush=True)
+
+
+def load_data_in_background():
+    try:
+        load_data()
+    except Exception as exc:
+        # /ready stays 503 so the failure is visible to the health check
+        print(f"Data load failed: {exc!r}", file=sys.stderr, flush=True)
+
 
 # Initialize the Dash app
 app = dash.Dash(__name__)
 app.title = "Executive Turnaround Time Dashboard"
+server = app.server  # WSGI entry point, e.g. gunicorn -w 4 dashboard4:server
 
-# Layout
-app.layout = html.Div([
-    html.Div([
+
+@server.route('/ready')
+def ready():
+    return ('ready', 200) if data_ready.is_set() else ('loading', 503)
+
+
+# Layout is built per page load, so visitors before the data is ready get a placeholder
+def serve_layout():
+    header = html.Div([
         html.H1("Turnaround Time Dashboard", style={'text-align': 'center', 'color': '#003366'}),
         html.P("Analyze and monitor turnaround times to identify bottlenecks and improve efficiency.",
                style={'text-align': 'center', 'color': '#666666'}),
-    ], style={'padding': '20px', 'background-color': '#f2f2f2'}),
-
-    html.Div([
-        html.Label("Select Date Range:", style={'font-weight': 'bold'}),
-        dcc.DatePickerRange(
-            id='date-picker',
-            start_date=data['Date'].min(),
-            end_date=data['Date'].max(),
-            display_format='YYYY-MM-DD',
-        ),
-    ], style={'margin-bottom': '20px'}),
-])
+    ], style={'padding': '20px', 'background-color': '#f2f2f2'})
+
+    if not data_ready.is_set():
+        return html.Div([
+            header,
+            html.P("Loading data, please refresh in a few seconds.", style={'text-align': 'center'}),
+        ])
+
+    return html.Div([
+        header,
+        html.Div([
+            html.Label("Select Date Range:", style={'font-weight': 'bold'}),
+            dcc.DatePickerRange(
+                id='date-picker',
+                start_date=data['Date'].min().date(),
+                end_date=data['Date'].max().date(),
+                display_format='YYYY-MM-DD',
+            ),
+        ], style={'margin-bottom': '20px'}),
+    ])
+
+
+app.layout = serve_layout
+
+# `python dashboard4.py --prepare` builds the snapshots ahead of time (e.g. as the Render build step)
+if __name__ == "__main__" and '--prepare' in sys.argv:
+    load_data()
+    sys.exit(0)
+
+threading.Thread(target=load_data_in_background, daemon=True).start()
 
 # Allow deployment via Waitress
 if __name__ == "__main__":
     from waitress import serve
     port = int(os.environ.get("PORT", 8080))  # Get port from environment for Render
+    print(f"Binding port {port} {time.perf_counter() - started:.2f}s after start", flush=True)
     serve(app, host="0.0.0.0", port=port)
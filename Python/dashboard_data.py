@@ -0,0 +1,259 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+
+from callback_metrics import timed
+from snapshot_cache import cache_dir_for, read_csv_cached
+from turnaround_dataset import read_turnaround_dataset
+
+# Columns the charts, filters and summary tiles read, in display order
+DASHBOARD_COLUMNS = [
+    'Accession', 'End Date', 'Finalize Time', 'Date', 'Turnaround_Time_Hours',
+    'Modality', 'Exam', 'Base Class', 'Department', 'Hospital Location', 'Radiologist Group',
+]
+# What is loaded: None keeps the dashboard columns plus every other source column (e.g. the
+# productivity Section), since the Detailed Records table and the export show them all.
+# A list narrows the load, e.g. for a very wide legacy CSV.
+TABLE_COLUMNS = None
+CATEGORY_COLUMNS = ['Modality', 'Exam', 'Base Class', 'Department', 'Hospital Location', 'Radiologist Group']
+MEASURE_COLUMNS = ['Turnaround_Time_Hours']
+# Grain of the pre-aggregated turnaround cube the charts and summary metrics read from
+CUBE_DIMENSIONS = ['Date', 'Modality', 'Hospital Location', 'Department', 'Radiologist Group']
+# Optional load window, e.g. MILV_LOAD_START=2024-01-01 MILV_LOAD_MODALITIES=CT,MR; on the partitioned
+# dataset, Month/Modality partitions and End Date row groups outside it are never read
+LOAD_START = os.getenv('MILV_LOAD_START') or None
+LOAD_END = os.getenv('MILV_LOAD_END') or None
+LOAD_MODALITIES = [m for m in os.getenv('MILV_LOAD_MODALITIES', '').split(',') if m] or None
+
+
+def compact_frame(data, columns=TABLE_COLUMNS):
+    data = data.loc[:, ~data.columns.str.contains('^Unnamed')]
+    if columns is None:
+        columns = DASHBOARD_COLUMNS + [col for col in data.columns if col not in DASHBOARD_COLUMNS]
+    data = data[[col for col in columns if col in data.columns]].copy()
+
+    data['Finalize Time'] = pd.to_datetime(data['Finalize Time'], errors='coerce')
+    data['End Date'] = pd.to_datetime(data['End Date'], errors='coerce')
+    # Midnight timestamps instead of datetime.date objects, so date filters stay vectorized
+    data['Date'] = data['End Date'].dt.normalize()
+
+    for col in CATEGORY_COLUMNS:
+        if col in data.columns:
+            data[col] = data[col].astype('category')
+    # Other repetitive text columns (sections, codes, names) are stored as categories too
+    for col in data.columns.difference(CATEGORY_COLUMNS):
+        column = data[col]
+        if (pd.api.types.is_object_dtype(column) or isinstance(column.dtype, pd.StringDtype)) \
+                and column.nunique() <= len(column) // 2:
+            data[col] = column.astype('category')
+    # Turnaround hours only need a few significant digits, well within float32
+    for col in MEASURE_COLUMNS:
+        if col in data.columns:
+            data[col] = pd.to_numeric(data[col], errors='coerce').astype('float32')
+    return data
+
+
+def load_dashboard_data(path, columns=TABLE_COLUMNS, start_date=LOAD_START, end_date=LOAD_END,
+                        modalities=LOAD_MODALITIES):
+    # A directory is the partitioned Parquet output of processdata.py; only the matching
+    # Month/Modality partitions and End Date row groups are read. A file is the legacy CSV.
+    if os.path.isdir(path):
+        raw = read_turnaround_dataset(path, start_date, end_date, modalities, columns)
+        # Month is only the partition key, not a source column
+        return compact_frame(raw.drop(columns=['Month'], errors='ignore'), columns)
+
+    # The legacy CSV has nothing to prune, so the same window is applied after parsing
+    data = compact_frame(read_csv_cached(path, low_memory=False), columns)
+    mask = pd.Series(True, index=data.index)
+    if start_date is not None:
+        mask &= data['Date'] >= pd.Timestamp(start_date).normalize()
+    if end_date is not None:
+        mask &= data['Date'] <= pd.Timestamp(end_date).normalize()
+    if modalities:
+        mask &= data['Modality'].isin(modalities)
+    return data if mask.all() else data[mask].reset_index(drop=True)
+
+
+def _arrow_is_current(arrow_path, stat):
+    if not os.path.exists(arrow_path):
+        return False
+    with pa.memory_map(arrow_path) as source:
+        meta = pa.ipc.open_file(source).schema.metadata or {}
+    # Files written before categories were stored as codes are rebuilt
+    return (meta.get(b'source_size') == str(stat.st_size).encode()
+            and meta.get(b'source_mtime_ns') == str(stat.st_mtime_ns).encode()
+            and b'dashboard_categories' in meta)
+
+
+def load_shared_dashboard_data(path, columns=TABLE_COLUMNS, cache_dir=None):
+    # Multi-worker mode: the compact frame is written once to an Arrow IPC file and every
+    # worker memory-maps it, so numeric/datetime/category-code buffers live in the shared page cache.
+    # Categoricals are stored as plain integer code columns plus their categories in the file's
+    # metadata: to_pandas copies Arrow dictionary columns into each worker, but maps integers as is
+    # A load window gets its own file, so changing MILV_LOAD_* never maps a stale slice
+    window = '' if (LOAD_START, LOAD_END, LOAD_MODALITIES) == (None, None, None) else '-' + hashlib.sha1(
+        repr((LOAD_START, LOAD_END, LOAD_MODALITIES)).encode()).hexdigest()[:12]
+    arrow_path = os.path.join(cache_dir_for(path, cache_dir),
+                              os.path.splitext(os.path.basename(path))[0] + f'-dashboard{window}.arrow')
+    stat = os.stat(path)
+    if not _arrow_is_current(arrow_path, stat):
+        # Date-sorted on disk so FilterIndex can use the mapping without re-sorting a private copy
+        data = load_dashboard_data(path, columns).sort_values('Date', kind='stable', na_position='last')
+        categories = {col: data[col].cat.categories.tolist() for col in data.columns
+                      if isinstance(data[col].dtype, pd.CategoricalDtype)}
+        codes = data.assign(**{col: data[col].cat.codes for col in categories})
+        table = pa.Table.from_pandas(codes, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                               b'source_size': str(stat.st_size).encode(),
+                                               b'source_mtime_ns': str(stat.st_mtime_ns).encode(),
+                                               b'dashboard_categories': json.dumps(categories).encode()})
+        # Workers racing to build it each write their own temp file; the rename is atomic
+        tmp_path = f"{arrow_path}.{os.getpid()}.tmp"
+        with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, arrow_path)
+
+    # The mapping stays open for as long as the frame references its buffers
+    table = pa.ipc.open_file(pa.memory_map(arrow_path)).read_all()
+    data = table.to_pandas(split_blocks=True)
+    # Codes are already in pandas' own code dtype, so the categoricals wrap the mapped buffers.
+    # The frame is assembled in one step because assigning a column would copy it
+    categories = json.loads(table.schema.metadata[b'dashboard_categories'])
+    return pd.DataFrame({col: pd.Categorical.from_codes(data[col].to_numpy(), categories=categories[col],
+                                                        validate=False) if col in categories else data[col]
+                         for col in data.columns}, copy=False)
+
+
+def build_tat_cube(data):
+    # sum/count/min/max of turnaround hours per dimension combination, plus the raw record count
+    dims = [col for col in CUBE_DIMENSIONS if col in data.columns]
+    tat = data['Turnaround_Time_Hours'].astype('float64')
+    grouped = tat.groupby([data[col] for col in dims], observed=True, dropna=False)
+    cube = grouped.agg(['sum', 'count', 'min', 'max'])
+    cube['records'] = grouped.size()
+    return cube.reset_index()
+
+
+def load_dashboard(path, columns=TABLE_COLUMNS):
+    # Raw rows for the table/export paths and the cube for everything else, always rebuilt together
+    data = load_dashboard_data(path, columns)
+    return data, build_tat_cube(data)
+
+
+@timed('filter')
+def date_range_mask(data, start_date, end_date):
+    # Inclusive day range; the picker sends 'YYYY-MM-DD' strings. A missing bound is open, as in FilterIndex
+    mask = pd.Series(True, index=data.index)
+    if start_date:
+        mask &= data['Date'] >= pd.Timestamp(start_date).normalize()
+    if end_date:
+        mask &= data['Date'] <= pd.Timestamp(end_date).normalize()
+    return mask
+
+
+@timed('filter')
+def filter_mask(frame, start_date, end_date, modalities=None, hospitals=None):
+    # Works on raw rows and on the cube, which share the filter columns
+    mask = date_range_mask(frame, start_date, end_date)
+    if modalities:
+        mask &= frame['Modality'].isin(modalities)
+    if hospitals:
+        mask &= frame['Hospital Location'].isin(hospitals)
+    return mask
+
+
+@timed('aggregate')
+def cube_summary(cube):
+    # (average, max, record count) for a filtered slice of the cube
+    count = cube['count'].sum()
+    average = cube['sum'].sum() / count if count else float('nan')
+    return average, cube['max'].max(), int(cube['records'].sum())
+
+
+@timed('aggregate')
+def cube_daily_average(cube):
+    daily = cube.groupby('Date')[['sum', 'count']].sum()
+    return (daily['sum'] / daily['count']).rename('Turnaround_Time_Hours').reset_index()
+
+
+@timed('aggregate')
+def cube_heatmap_frame(cube, group_by):
+    # Per-cell sums; density_heatmap's default sum histfunc then matches the raw-row heatmap
+    heatmap = cube.groupby(['Date', group_by], observed=True)['sum'].sum()
+    return heatmap.rename('Turnaround_Time_Hours').reset_index()
+
+
+# DataTable filter_query operators (backend filtering), longest spellings first
+FILTER_OPERATORS = [
+    ['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'],
+    ['ne ', '!='], ['eq ', '='], ['contains '], ['datestartswith '],
+]
+
+
+def split_filter_part(filter_part):
+    # '{Modality} contains CT' -> ('Modality', 'contains', 'CT'). Unquoted numbers become floats only
+    # for the relational operators; contains/datestartswith match the text as typed ('12', not '12.0')
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+                operator_name = operator_type[0].strip()
+                value_part = value_part.strip()
+                if value_part and value_part[0] == value_part[-1] and value_part[0] in ("'", '"', '`'):
+                    value = value_part[1:-1].replace('\\' + value_part[0], value_part[0])
+                elif operator_name in ('contains', 'datestartswith'):
+                    value = value_part
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+                return name, operator_name, value
+    return None, None, None
+
+
+@timed('filter')
+def table_query_positions(data, positions, filter_query, sort_by):
+    # DataTable filter_query and sort_by applied to row positions of `data`; only the columns the
+    # query names are read, and the rows themselves are never copied
+    for filter_part in (filter_query or '').split(' && '):
+        col_name, operator, value = split_filter_part(filter_part)
+        if col_name not in data.columns:
+            continue
+        column = data[col_name].iloc[positions]
+        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            if pd.api.types.is_datetime64_any_dtype(column):
+                value = pd.Timestamp(value)
+            elif isinstance(column.dtype, pd.CategoricalDtype):
+                column = column.astype(str)
+                value = str(value)
+            mask = getattr(column, operator)(value)
+        elif operator == 'contains':
+            mask = column.astype(str).str.contains(str(value), case=False, regex=False, na=False)
+        elif operator == 'datestartswith':
+            mask = column.astype(str).str.startswith(str(value), na=False)
+        else:
+            continue
+        positions = positions[mask.to_numpy(dtype=bool)]
+
+    sort_by = [col for col in (sort_by or []) if col['column_id'] in data.columns]
+    if sort_by:
+        columns = [col['column_id'] for col in sort_by]
+        keys = data[columns].iloc[positions].reset_index(drop=True)
+        order = keys.sort_values(columns, ascending=[col['direction'] == 'asc' for col in sort_by],
+                                 kind='stable').index.to_numpy()
+        positions = positions[order]
+    return positions
+
+
+@timed('aggregate')
+def page_records(data, positions, page_current, page_size):
+    # Only the requested page is copied and serialized; page_count lets the table render its pager
+    page_count = max(1, -(-len(positions) // page_size))
+    page_current = min(page_current or 0, page_count - 1)
+    start = page_current * page_size
+    return data.iloc[positions[start:start + page_size]].to_dict('records'), page_count
@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from callback_metrics import timed
+
+# Point budgets that keep figure payloads and browser render time bounded however much
+# history is selected. Series are thinned server-side; anything still large is drawn with WebGL.
+MAX_POINTS = int(os.getenv('MILV_MAX_POINTS', 2000))  # Per line series
+MAX_HEATMAP_COLUMNS = int(os.getenv('MILV_MAX_HEATMAP_COLUMNS', 400))  # Date columns per heatmap
+WEBGL_THRESHOLD = int(os.getenv('MILV_WEBGL_THRESHOLD', 1000))  # Points per trace before switching to Scattergl
+
+
+def _numeric(values):
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype('int64').to_numpy(dtype='float64')
+    return pd.to_numeric(values, errors='coerce').to_numpy(dtype='float64')
+
+
+def lttb_indices(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: keeps the first and last points and, per bucket, the point
+    # forming the largest triangle with the previous pick and the next bucket's average
+    x, y = _numeric(x), _numeric(y)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    picks = np.empty(n_out, dtype=int)
+    picks[0], picks[-1] = 0, n - 1
+    previous = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[stop:next_stop].mean()
+        avg_y = y[stop:next_stop].mean()
+        area = np.abs((x[previous] - avg_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (avg_y - y[previous]))
+        previous = start + int(np.nanargmax(area)) if np.isfinite(area).any() else start
+        picks[i + 1] = previous
+    return picks
+
+
+@timed('aggregate')
+def downsample(frame, x, y, max_points=MAX_POINTS):
+    # Thin a series to at most max_points rows, ordered by x
+    if len(frame) <= max_points:
+        return frame
+    frame = frame.sort_values(x, kind='stable')
+    return frame.iloc[lttb_indices(frame[x], frame[y], max_points)]
+
+
+@timed('aggregate')
+def envelope(frame, x, lower, upper, max_points=MAX_POINTS):
+    # Min of `lower` and max of `upper` over max_points equal buckets of rows ordered by x, so a
+    # thinned band still covers every spike. Each bucket is labelled by its first x
+    if len(frame) <= max_points:
+        return frame
+    frame = frame.sort_values(x, kind='stable')
+    bucket = np.arange(len(frame)) * max_points // len(frame)
+    return frame.groupby(bucket).agg({x: 'first', lower: 'min', upper: 'max'}).reset_index(drop=True)
+
+
+@timed('aggregate')
+def coarsen_heatmap(frame, x, y, z, max_columns=MAX_HEATMAP_COLUMNS):
+    # Sum z into equal-width date bins when there are more dates than columns to draw.
+    # Bins are labelled by their first day; density_heatmap's sum histfunc gives the same totals.
+    dates = frame[x].drop_duplicates()
+    if len(dates) <= max_columns:
+        return frame
+    first, last = dates.min(), dates.max()
+    width = pd.Timedelta(days=-(-((last - first).days + 1) // max_columns))
+    binned = frame.assign(**{x: first + ((frame[x] - first) // width) * width})
+    return binned.groupby([x, y], observed=True, as_index=False)[z].sum()
+
+
+@timed('figure')
+def use_webgl(figure, threshold=WEBGL_THRESHOLD):
+    # Redraw large SVG scatter/line traces as Scattergl; smaller traces keep SVG rendering
+    if not any(trace.type == 'scatter' and trace.x is not None and len(trace.x) > threshold
+               for trace in figure.data):
+        return figure
+    traces = []
+    for trace in figure.data:
+        if trace.type == 'scatter' and trace.x is not None and len(trace.x) > threshold:
+            properties = trace.to_plotly_json()
+            properties.pop('type', None)
+            trace = go.Scattergl(properties)
+        traces.append(trace)
+    return go.Figure(data=traces, layout=figure.layout)
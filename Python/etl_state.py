@@ -0,0 +1,86 @@
+import json
+import os
+
+import pandas as pd
+
+# Running state for incremental turnaround runs:
+#   state.json       - End Date watermark plus the global sum/count of turnaround hours
+#   daily.parquet    - per-day sum/count of turnaround hours
+#   accessions.parquet - every Accession already merged into the output store
+
+# Volume rows that ended up to this long before the watermark are still merged, for exams whose
+# reports are finalized after later exams were already merged; older unmatched rows are not retried
+LATE_ARRIVAL = pd.Timedelta(days=int(os.getenv('MILV_LATE_ARRIVAL_DAYS', 7)))
+
+
+def load_state(state_dir):
+    state = {
+        'watermark': None,
+        'total_sum': 0.0,
+        'total_count': 0,
+        'daily': pd.DataFrame({'sum': pd.Series(dtype=float), 'count': pd.Series(dtype='int64')},
+                              index=pd.DatetimeIndex([], name='Date')),
+        'accessions': pd.Index([], dtype='int64'),
+    }
+    meta_path = os.path.join(state_dir, 'state.json')
+    if not os.path.exists(meta_path):
+        return state
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+    state['watermark'] = pd.Timestamp(meta['watermark']) if meta['watermark'] else None
+    state['total_sum'] = meta['total_sum']
+    state['total_count'] = meta['total_count']
+    state['daily'] = pd.read_parquet(os.path.join(state_dir, 'daily.parquet'))
+    state['accessions'] = pd.Index(pd.read_parquet(os.path.join(state_dir, 'accessions.parquet'))['Accession'])
+    return state
+
+
+def update_state(state, merged_df):
+    # Fold a batch of newly merged rows into the running state
+    if merged_df.empty:
+        return state
+    tat = merged_df['Turnaround_Time_Hours']
+    state['total_sum'] += float(tat.sum())
+    state['total_count'] += int(len(tat))
+
+    by_day = tat.groupby(merged_df['End Date'].dt.normalize().rename('Date')).agg(['sum', 'count'])
+    state['daily'] = state['daily'].add(by_day, fill_value=0).astype({'count': 'int64'}).sort_index()
+
+    state['accessions'] = state['accessions'].append(pd.Index(merged_df['Accession'].astype('int64').unique()))
+    batch_max = merged_df['End Date'].max()
+    state['watermark'] = batch_max if state['watermark'] is None else max(state['watermark'], batch_max)
+    return state
+
+
+def save_state(state, state_dir):
+    os.makedirs(state_dir, exist_ok=True)
+    state['daily'].to_parquet(os.path.join(state_dir, 'daily.parquet'))
+    pd.DataFrame({'Accession': state['accessions'].unique()}).to_parquet(
+        os.path.join(state_dir, 'accessions.parquet'), index=False)
+    with open(os.path.join(state_dir, 'state.json'), 'w') as f:
+        json.dump({
+            'watermark': state['watermark'].isoformat() if state['watermark'] is not None else None,
+            'total_sum': state['total_sum'],
+            'total_count': state['total_count'],
+        }, f)
+
+
+def unmerged_volume(volume_df, state):
+    # Volume rows past the watermark (less the late-arrival window) whose Accession was not merged yet
+    new = ~volume_df['Accession'].isin(state['accessions'])
+    if state['watermark'] is not None:
+        new &= volume_df['End Date'] > state['watermark'] - LATE_ARRIVAL
+    return volume_df[new]
+
+
+def global_mean(state):
+    return state['total_sum'] / state['total_count'] if state['total_count'] else float('nan')
+
+
+def daily_average(state):
+    daily = state['daily']
+    daily_avg = daily['sum'] / daily['count']
+    daily_avg.index = daily_avg.index.date
+    daily_avg.index.name = 'Date'
+    return daily_avg
@@ -0,0 +1,67 @@
+import glob
+import os
+import sys
+import time
+
+import pandas as pd
+
+from snapshot_cache import load_snapshot
+
+# Workbooks converted by `python excel_cache.py` when no paths are given, relative to the repo root
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_WORKBOOKS = ['*.xlsx', os.path.join('BI', '*.xlsx')]
+
+
+def _column_names(header):
+    # Same naming pd.read_excel uses for blank and repeated headers
+    names, seen = [], {}
+    for i, name in enumerate(header):
+        name = f"Unnamed: {i}" if name is None else str(name)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _read_sheet(path, sheet_name=0):
+    from openpyxl import load_workbook
+    # read_only streams rows out of the sheet XML instead of building every cell object
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[sheet_name] if isinstance(sheet_name, int) else workbook[sheet_name]
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, ())
+        df = pd.DataFrame.from_records(rows, columns=_column_names(header), coerce_float=True)
+    finally:
+        workbook.close()
+
+    # Read-only dimensions can include formatted-but-empty trailing rows and columns
+    df = df.dropna(how='all')
+    df = df.loc[:, ~(df.columns.str.startswith('Unnamed: ') & df.isna().all())]
+    return df.infer_objects().reset_index(drop=True)
+
+
+def read_excel_cached(path, sheet_name=0, cache_dir=None):
+    # Drop-in for pd.read_excel(path, sheet_name=...) backed by a per-sheet Parquet snapshot
+    return load_snapshot(path, _read_sheet, {'sheet_name': sheet_name}, cache_dir)
+
+
+def convert_workbook(path, cache_dir=None):
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True)
+    sheet_names = workbook.sheetnames
+    workbook.close()
+    return {name: read_excel_cached(path, name, cache_dir) for name in sheet_names}
+
+
+if __name__ == '__main__':
+    workbooks = sys.argv[1:] or sorted(
+        path for pattern in DEFAULT_WORKBOOKS for path in glob.glob(os.path.join(REPO_ROOT, pattern)))
+    for workbook_path in workbooks:
+        started = time.perf_counter()
+        sheets = convert_workbook(workbook_path)
+        summary = ', '.join(f"{name} ({len(df)} rows)" for name, df in sheets.items())
+        print(f"{os.path.basename(workbook_path)}: {summary} in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,147 @@
+import functools
+import hashlib
+import json
+import os
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from callback_metrics import note_cache_hit
+
+# Callback return values keyed by (callback, normalized inputs, data version). A hit skips the
+# filtering, aggregation and figure construction; Dash still JSON-encodes the returned object, once.
+# The cache is bounded by bytes: each entry's in-memory size is estimated once, when it is stored.
+MAX_BYTES = int(os.getenv('MILV_FIGURE_CACHE_BYTES', 64 << 20))
+SPILL_DIR = os.getenv('MILV_FIGURE_CACHE_DIR')  # Evicted entries are pickled here when set
+SIZE_SAMPLE = 64  # Items measured per long list/dict; the rest are assumed alike
+
+
+def source_version(path):
+    # Data version for caches keyed on a source file or dataset directory
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def estimate_size(obj):
+    # Approximate memory held by a callback result: figures, records lists and dicts are walked,
+    # and long containers are extrapolated from an even sample, so sizing a 100k-row records
+    # output costs about as much as sizing 64 of its rows
+    from plotly.basedatatypes import BaseFigure
+    if isinstance(obj, BaseFigure):
+        return estimate_size(obj.to_dict())
+    if isinstance(obj, np.ndarray):
+        if obj.dtype != object:
+            return obj.nbytes
+        obj = obj.ravel().tolist()
+    if isinstance(obj, dict):
+        items = list(obj.items()) if len(obj) <= SIZE_SAMPLE else [
+            (key, obj[key]) for key in list(obj)[::len(obj) // SIZE_SAMPLE][:SIZE_SAMPLE]]
+        measured = sum(sys.getsizeof(key) + estimate_size(value) for key, value in items)
+        return sys.getsizeof(obj) + measured * len(obj) // max(len(items), 1)
+    if isinstance(obj, (list, tuple)):
+        items = obj if len(obj) <= SIZE_SAMPLE else obj[::len(obj) // SIZE_SAMPLE][:SIZE_SAMPLE]
+        measured = sum(estimate_size(item) for item in items)
+        return sys.getsizeof(obj) + measured * len(obj) // max(len(items), 1)
+    return sys.getsizeof(obj)
+
+
+def _has_no_update(result):
+    from dash import no_update
+    items = result if isinstance(result, (list, tuple)) else [result]
+    return any(isinstance(item, type(no_update)) for item in items)
+
+
+class FigureCache:
+    def __init__(self, max_bytes=MAX_BYTES, spill_dir=SPILL_DIR):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.entries = OrderedDict()  # key -> (result, size in bytes)
+        self.size = 0
+        self.lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(name, args, version):
+        normalized = json.dumps([name, args, version], sort_keys=True, default=str)
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, key + '.pkl')
+
+    def get(self, key):
+        # Cached results are shared between requests; callers must not mutate them
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry[0]
+        if self.spill_dir and os.path.exists(self._spill_path(key)):
+            with open(self._spill_path(key), 'rb') as f:
+                result = pickle.load(f)
+            self.put(key, result)
+            return result
+        return None
+
+    def put(self, key, result):
+        size = estimate_size(result)
+        # Bigger than the whole budget (e.g. a large filtered record set): not kept at all
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (result, size)
+            self.size += size
+            evicted = []
+            while self.size > self.max_bytes:
+                old_key, (old_result, old_size) = self.entries.popitem(last=False)
+                self.size -= old_size
+                evicted.append((old_key, old_result))
+        # Only evictions pay for serialization, and only when spilling is on
+        for old_key, old_result in evicted:
+            if self.spill_dir and not os.path.exists(self._spill_path(old_key)):
+                tmp_path = f"{self._spill_path(old_key)}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(old_result, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self._spill_path(old_key))
+
+    def cached(self, name, version):
+        # Decorator for a Dash callback; version() returns the current data version
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args):
+                key = self.make_key(name, args, version())
+                result = self.get(key)
+                if result is not None:
+                    note_cache_hit()
+                    return result
+                result = func(*args)
+                # no_update results say nothing about the inputs, so they are not kept
+                if not _has_no_update(result):
+                    self.put(key, result)
+                return result
+            return wrapper
+        return decorator
+
+
+def register_etags(server):
+    # ETag GET responses (the layout and dependency payloads) so a reload revalidates with a bodiless 304.
+    # Callback updates are POSTs that browsers never revalidate, so they are left alone rather than hashed
+    from flask import request
+
+    @server.after_request
+    def add_etag(response):
+        if (request.method == 'GET' and response.status_code == 200 and not response.direct_passthrough
+                and response.get_etag()[0] is None):
+            response.add_etag()
+            response.make_conditional(request)
+        return response
+
+    return add_etag
+
+
+figure_cache = FigureCache()
@@ -0,0 +1,13 @@
+from callback_metrics import timed
+
+# Every plotly call a callback makes goes through build_figure, so trace and layout construction
+# lands in the 'figure' phase on /metrics instead of 'other'. Pass the builder and its arguments:
+#   build_figure(px.line, frame, x='Date', y='Turnaround_Time_Hours')
+#   build_figure(fig.update_layout, title_font_size=18)
+# The data arguments are evaluated by the caller first, so filtering and aggregation keep their own phases.
+
+
+@timed('figure')
+def build_figure(builder, *args, **kwargs):
+    # builder: a plotly.express function, go.Figure, or a method of an existing figure (add_scatter, update_layout, ...)
+    return builder(*args, **kwargs)
@@ -0,0 +1,88 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from callback_metrics import timed
+from dashboard_data import table_query_positions
+
+# Categorical filter dimensions, in the order callbacks pass their selections
+FILTER_DIMENSIONS = ['Modality', 'Hospital Location']
+CACHE_SIZE = 256
+
+
+class FilterIndex:
+    # Date-sorted rows, per-value position arrays and an LRU of resolved row sets,
+    # shared by every callback that filters on date range / modality / hospital
+
+    def __init__(self, data, dimensions=FILTER_DIMENSIONS, cache_size=CACHE_SIZE):
+        # Frames that arrive date-sorted (e.g. the shared Arrow mapping) are used as-is, not copied
+        dates = data['Date']
+        n_dated = int(dates.notna().sum())
+        if dates.iloc[:n_dated].notna().all() and dates.iloc[:n_dated].is_monotonic_increasing:
+            self.data = data
+        else:
+            self.data = data.sort_values('Date', kind='stable', na_position='last')
+        self.dates = self.data['Date'].to_numpy()
+        self.dimensions = list(dimensions)
+        self.positions = {dim: self._value_positions(self.data[dim]) for dim in self.dimensions if dim in self.data.columns}
+        self._resolve = lru_cache(maxsize=cache_size)(self._compute)
+        self._resolve_table = lru_cache(maxsize=cache_size)(self._compute_table)
+
+    @staticmethod
+    def _value_positions(column):
+        # value -> ascending row positions, built from one argsort of the category codes (NaN is -1)
+        column = column.astype('category')
+        codes, categories = column.cat.codes.to_numpy(), column.cat.categories
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(categories) + 1))
+        return {value: order[bounds[i]:bounds[i + 1]] for i, value in enumerate(categories)}
+
+    @staticmethod
+    def normalize(start_date, end_date, *selections):
+        # Equivalent filter states (list order, duplicates, None vs []) share one cache entry
+        start = pd.Timestamp(start_date).normalize() if start_date else None
+        end = pd.Timestamp(end_date).normalize() if end_date else None
+        return (start, end) + tuple(tuple(sorted(set(values), key=str)) if values else () for values in selections)
+
+    def _compute(self, start, end, *selections):
+        lo = 0 if start is None else np.searchsorted(self.dates, start.to_datetime64(), side='left')
+        hi = len(self.dates) if end is None else np.searchsorted(
+            self.dates, (end + pd.Timedelta(days=1)).to_datetime64(), side='left')
+        rows = None
+        for dim, values in zip(self.dimensions, selections):
+            if not values:
+                continue
+            # Each position array is sorted, so clip it to the date range before the union
+            parts = []
+            for value in values:
+                pos = self.positions.get(dim, {}).get(value)
+                if pos is not None and len(pos):
+                    parts.append(pos[np.searchsorted(pos, lo):np.searchsorted(pos, hi)])
+            matched = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.intp)
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+        if rows is None:
+            rows = np.arange(lo, hi)
+        rows.setflags(write=False)
+        return rows
+
+    def _compute_table(self, filters, filter_query, sort_key):
+        sort_by = [{'column_id': column_id, 'direction': direction} for column_id, direction in sort_key]
+        rows = table_query_positions(self.data, self._resolve(*filters), filter_query, sort_by)
+        rows.setflags(write=False)
+        return rows
+
+    @timed('filter')
+    def table_positions(self, start_date, end_date, *selections, filter_query='', sort_by=None):
+        # Rows after the DataTable's own filter and sort, in display order; cached per query,
+        # so paging through a result only slices this array
+        sort_key = tuple((col['column_id'], col['direction']) for col in sort_by or [])
+        return self._resolve_table(self.normalize(start_date, end_date, *selections), filter_query or '', sort_key)
+
+    @timed('filter')
+    def positions_for(self, start_date, end_date, *selections):
+        return self._resolve(*self.normalize(start_date, end_date, *selections))
+
+    @timed('filter')
+    def rows(self, start_date, end_date, *selections):
+        return self.data.iloc[self.positions_for(start_date, end_date, *selections)]
@@ -0,0 +1,114 @@
+import tempfile
+import zlib
+from urllib.parse import urlencode
+
+from flask import Response, request
+
+EXPORT_ROUTE = '/export/filtered'
+EXPORT_CHUNK_ROWS = 50_000
+FILE_BLOCK_BYTES = 1 << 20
+XLSX_SHEET_ROWS = 1_048_576 - 1  # Excel's per-sheet row limit, less the header row
+# format -> (file extension, mimetype)
+EXPORT_FORMATS = {
+    'csv': ('csv', 'text/csv'),
+    'csv.gz': ('csv.gz', 'application/gzip'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'xlsx': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+EXPORT_FORMAT_OPTIONS = [
+    {'label': 'CSV', 'value': 'csv'},
+    {'label': 'CSV (gzip)', 'value': 'csv.gz'},
+    {'label': 'Parquet', 'value': 'parquet'},
+    {'label': 'Excel', 'value': 'xlsx'},
+]
+
+
+def export_url(start_date, end_date, modalities, hospitals, export_format='csv'):
+    # Built on click from the callback's State values; the route does the actual filtering
+    query = {'start_date': start_date or '', 'end_date': end_date or '',
+             'modality': modalities or [], 'hospital': hospitals or [], 'format': export_format or 'csv'}
+    return f"{EXPORT_ROUTE}?{urlencode(query, doseq=True)}"
+
+
+def _chunks(data, positions):
+    # Only one chunk of the selected rows is ever copied out of `data`
+    for start in range(0, len(positions), EXPORT_CHUNK_ROWS):
+        yield data.iloc[positions[start:start + EXPORT_CHUNK_ROWS]]
+
+
+def _csv_stream(data, positions):
+    yield data.iloc[:0].to_csv(index=False)
+    for chunk in _chunks(data, positions):
+        yield chunk.to_csv(index=False, header=False)
+
+
+def _gzip_stream(text_stream):
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for text in text_stream:
+        block = compressor.compress(text.encode('utf-8'))
+        if block:
+            yield block
+    yield compressor.flush()
+
+
+def _spooled_stream(write):
+    # Parquet/xlsx need a seekable file; spool it (to disk past 64 MB) and stream it back out
+    with tempfile.SpooledTemporaryFile(max_size=64 << 20) as f:
+        write(f)
+        f.seek(0)
+        for block in iter(lambda: f.read(FILE_BLOCK_BYTES), b''):
+            yield block
+
+
+def _write_parquet(data, positions, f):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.Schema.from_pandas(data.iloc[:0], preserve_index=False)
+    with pq.ParquetWriter(f, schema) as writer:
+        for chunk in _chunks(data, positions):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+def _write_xlsx(data, positions, f, sheet_rows=XLSX_SHEET_ROWS):
+    from openpyxl import Workbook
+    # write_only keeps openpyxl from holding every cell object in memory
+    workbook = Workbook(write_only=True)
+    # Past Excel's row limit the rows continue on 'Filtered Data (2)', '(3)', ..., each with its own header
+    for number, sheet_start in enumerate(range(0, max(len(positions), 1), sheet_rows), start=1):
+        sheet = workbook.create_sheet('Filtered Data' if number == 1 else f'Filtered Data ({number})')
+        sheet.append([str(col) for col in data.columns])
+        for chunk in _chunks(data, positions[sheet_start:sheet_start + sheet_rows]):
+            chunk = chunk.astype(object).where(chunk.notna(), None)
+            for row in chunk.itertuples(index=False):
+                sheet.append(list(row))
+    workbook.save(f)
+
+
+def stream_export(data, positions, export_format):
+    # Rows `positions` of `data`, written chunk by chunk; the filtered frame is never materialized
+    if export_format == 'csv':
+        body = (text.encode('utf-8') for text in _csv_stream(data, positions))
+    elif export_format == 'csv.gz':
+        body = _gzip_stream(_csv_stream(data, positions))
+    elif export_format == 'parquet':
+        body = _spooled_stream(lambda f: _write_parquet(data, positions, f))
+    else:
+        body = _spooled_stream(lambda f: _write_xlsx(data, positions, f))
+    extension, mimetype = EXPORT_FORMATS[export_format]
+    return Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="Filtered_Data.{extension}"'})
+
+
+def register_export_route(server, data, resolve_positions):
+    # resolve_positions(start_date, end_date, modalities, hospitals) -> row positions of `data`;
+    # a missing date is an open bound
+    @server.route(EXPORT_ROUTE)
+    def export_filtered():
+        export_format = request.args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return f"Unsupported export format: {export_format}", 400
+        positions = resolve_positions(request.args.get('start_date') or None, request.args.get('end_date') or None,
+                                      request.args.getlist('modality'), request.args.getlist('hospital'))
+        return stream_export(data, positions, export_format)
+
+    return export_filtered
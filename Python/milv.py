@@ -1,14 +1,17 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 import plotly.express as px
+from snapshot_cache import read_csv_cached
+from volume_loader import read_volume
 
 # File paths
 productivity_file = r'C:\Users\aliso\OneDrive\Desktop\MILV\Python\Productivity_with_sections.csv'
 volume_file = r'C:\Users\aliso\OneDrive\Desktop\MILV\Python\Volume.csv'
 
 # Load the data
-productivity_df = pd.read_csv(productivity_file, low_memory=False)
-volume_df = pd.read_csv(volume_file)
+productivity_df = read_csv_cached(productivity_file, low_memory=False)
+productivity_df['Accession'] = pd.to_numeric(productivity_df['Accession'], errors='coerce')
+volume_df = read_volume(volume_file)
 
 # Merge the datasets on 'Accession'
 merged_df = pd.merge(productivity_df, volume_df, on='Accession', how='inner')
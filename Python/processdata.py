@@ -1,48 +1,161 @@
+import argparse
+import os
+import shutil
 import pandas as pd
-import matplotlib.pyplot as plt
+from source_schemas import read_source, read_source_cached
+from volume_loader import read_volume
+from turnaround_dataset import append_turnaround_dataset, iter_turnaround_dataset, write_turnaround_dataset
+import etl_state
 
-# File paths
-productivity_file = r'C:\Users\aliso\OneDrive\Desktop\MILV\Python\Productivity_with_sections.csv'
-volume_file = r'C:\Users\aliso\OneDrive\Desktop\MILV\Python\Volume.csv'
+# File paths; MILV_DATA_DIR points the whole run at another folder (e.g. the benchmark's synthetic data)
+data_dir = os.getenv('MILV_DATA_DIR', r'C:\Users\aliso\OneDrive\Desktop\MILV\Python')
+productivity_file = os.path.join(data_dir, 'Productivity_with_sections.csv')
+volume_file = os.path.join(data_dir, 'Volume.csv')
+merged_file = os.path.join(data_dir, 'Merged_Turnaround.csv')
+merged_dataset = os.path.join(data_dir, 'Merged_Turnaround')
+above_average_dataset = os.path.join(data_dir, 'Above_Average_Turnaround')
+trend_file = os.path.join(data_dir, 'Turnaround_Time_Trend.png')
+state_dir = os.path.join(data_dir, '.milv_state')
 
-# Load the data
-productivity_df = pd.read_csv(productivity_file, low_memory=False)
-volume_df = pd.read_csv(volume_file)
 
-# Merge the datasets on 'Accession'
-merged_df = pd.merge(productivity_df, volume_df, on='Accession', how='inner')
+def add_turnaround(merged_df):
+    # Ensure datetime parsing for relevant columns
+    merged_df['Finalize Time'] = pd.to_datetime(merged_df['Finalize Time'], errors='coerce')
+    merged_df['End Date'] = pd.to_datetime(merged_df['End Date'], errors='coerce')
 
-# Ensure datetime parsing for relevant columns
-merged_df['Finalize Time'] = pd.to_datetime(merged_df['Finalize Time'], errors='coerce')
-merged_df['End Date'] = pd.to_datetime(merged_df['End Date'], errors='coerce')
+    # Calculate turnaround time in hours
+    merged_df['Turnaround_Time_Hours'] = (merged_df['Finalize Time'] - merged_df['End Date']).dt.total_seconds() / 3600
 
-# Calculate turnaround time in hours
-merged_df['Turnaround_Time_Hours'] = (merged_df['Finalize Time'] - merged_df['End Date']).dt.total_seconds() / 3600
+    # Remove rows with negative or missing turnaround time
+    return merged_df[(merged_df['Turnaround_Time_Hours'] >= 0) & (merged_df['Turnaround_Time_Hours'].notna())]
 
-# Remove rows with negative or missing turnaround time
-merged_df = merged_df[(merged_df['Turnaround_Time_Hours'] >= 0) & (merged_df['Turnaround_Time_Hours'].notna())]
 
-# Calculate average turnaround time
-average_turnaround = merged_df['Turnaround_Time_Hours'].mean()
+def run_in_memory():
+    # Load the data; only the productivity columns declared in source_schemas are parsed
+    productivity_df = read_source_cached(productivity_file, 'productivity')
+    productivity_df['Accession'] = pd.to_numeric(productivity_df['Accession'], errors='coerce')
+    volume_df = read_volume(volume_file)
 
-# Filter rows with above-average turnaround times
-above_average_df = merged_df[merged_df['Turnaround_Time_Hours'] > average_turnaround]
+    # Merge the datasets on 'Accession'
+    merged_df = pd.merge(productivity_df, volume_df, on='Accession', how='inner')
+    merged_df = add_turnaround(merged_df)
 
-# Save the filtered data
-above_average_file = r'C:\Users\aliso\OneDrive\Desktop\MILV\Python\Above_Average_Turnaround.csv'
-above_average_df.to_csv(above_average_file, index=False)
-print(f"Filtered data saved to {above_average_file}")
+    # Calculate average turnaround time
+    average_turnaround = merged_df['Turnaround_Time_Hours'].mean()
 
-# Create a visualization of average turnaround time by day
-merged_df['Date'] = merged_df['End Date'].dt.date
-daily_avg = merged_df.groupby('Date')['Turnaround_Time_Hours'].mean()
+    # Filter rows with above-average turnaround times
+    above_average_df = merged_df[merged_df['Turnaround_Time_Hours'] > average_turnaround]
+    write_turnaround_dataset([above_average_df], above_average_dataset)
 
-# Plot daily trends
-plt.figure(figsize=(10, 6))
-plt.plot(daily_avg.index, daily_avg.values, marker='o')
-plt.title('Daily Average Turnaround Time')
-plt.xlabel('Date')
-plt.ylabel('Average Turnaround Time (Hours)')
-plt.grid()
-plt.savefig(r'C:\Users\aliso\OneDrive\Desktop\MILV\Python\Turnaround_Time_Trend.png')
-print("Trend visualization saved as 'Turnaround_Time_Trend.png'")
+    # Average turnaround time by day
+    merged_df['Date'] = merged_df['End Date'].dt.date
+    return merged_df.groupby('Date')['Turnaround_Time_Hours'].mean()
+
+
+def run_streaming(chunk_size):
+    # Hash index of the (smaller) volume side; the productivity side is never fully loaded
+    volume_index = read_volume(volume_file).set_index('Accession')
+
+    # Pass 1: merge each chunk, keep valid rows on disk and running sums in memory
+    total_sum, total_count = 0.0, 0
+    daily_sum, daily_count = pd.Series(dtype=float), pd.Series(dtype='int64')
+    write_header = True
+    for chunk in read_source(productivity_file, 'productivity', chunksize=chunk_size):
+        # Chunks can infer different dtypes, so align the join key explicitly
+        chunk['Accession'] = pd.to_numeric(chunk['Accession'], errors='coerce')
+        merged_chunk = add_turnaround(chunk.join(volume_index, on='Accession', how='inner'))
+        if merged_chunk.empty:
+            continue
+
+        tat = merged_chunk['Turnaround_Time_Hours']
+        total_sum += tat.sum()
+        total_count += len(tat)
+        by_day = tat.groupby(merged_chunk['End Date'].dt.date)
+        daily_sum = daily_sum.add(by_day.sum(), fill_value=0)
+        daily_count = daily_count.add(by_day.count(), fill_value=0)
+
+        merged_chunk.to_csv(merged_file, mode='w' if write_header else 'a', header=write_header, index=False)
+        write_header = False
+
+    # Pass 2: stream the merged rows back and keep the above-average ones
+    average_turnaround = total_sum / total_count if total_count else float('nan')
+    if total_count:
+        chunks = read_source(merged_file, 'merged', chunksize=chunk_size)
+        write_turnaround_dataset((chunk[chunk['Turnaround_Time_Hours'] > average_turnaround] for chunk in chunks),
+                                 above_average_dataset)
+        os.remove(merged_file)
+
+    daily_avg = (daily_sum / daily_count).sort_index()
+    daily_avg.index.name = 'Date'
+    return daily_avg
+
+
+def run_incremental(state_dir, chunk_size=100_000):
+    state = etl_state.load_state(state_dir)
+
+    # The merged history is a Parquet dataset that each run appends to; it starts fresh alongside fresh state
+    if state['total_count'] == 0:
+        shutil.rmtree(merged_dataset, ignore_errors=True)
+    elif os.path.exists(merged_file) and not os.path.isdir(merged_dataset):
+        # History merged before the store was Parquet is converted once
+        append_turnaround_dataset(read_source(merged_file, 'merged', chunksize=chunk_size), merged_dataset, 'history')
+
+    # New rows: volume past the watermark whose Accession has not been merged by an earlier run
+    new_volume = etl_state.unmerged_volume(read_volume(volume_file), state)
+
+    new_df = pd.DataFrame()
+    if not new_volume.empty:
+        # Productivity is streamed and joined against the new exams only, so memory follows the batch
+        volume_index = new_volume.set_index('Accession')
+        parts = []
+        for chunk in read_source(productivity_file, 'productivity', chunksize=chunk_size):
+            chunk['Accession'] = pd.to_numeric(chunk['Accession'], errors='coerce')
+            parts.append(add_turnaround(chunk.join(volume_index, on='Accession', how='inner')))
+        new_df = pd.concat(parts, ignore_index=True) if parts else new_df
+
+    if new_df.empty:
+        print(f"No new rows since {state['watermark']}")
+    else:
+        # Only the new rows are written, as new files in the history's Month/Modality partitions
+        append_turnaround_dataset([new_df], merged_dataset, pd.Timestamp.now().strftime('%Y%m%dT%H%M%S'))
+        state = etl_state.update_state(state, new_df)
+        etl_state.save_state(state, state_dir)
+        print(f"Merged {len(new_df)} new rows (watermark {state['watermark']})")
+
+    # The cut is the global mean, which moves with every merged batch, so rows of any month can cross
+    # it: the above-average dataset is rebuilt from a filtered scan of the Parquet history, and only
+    # when this run merged something (or it does not exist yet)
+    if state['total_count'] and (not new_df.empty or not os.path.isdir(above_average_dataset)):
+        write_turnaround_dataset(iter_turnaround_dataset(merged_dataset, etl_state.global_mean(state)),
+                                 above_average_dataset)
+
+    return etl_state.daily_average(state)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge productivity and volume extracts and compute turnaround times.')
+    parser.add_argument('--chunk-size', type=int, default=int(os.getenv('CHUNK_SIZE', 0)),
+                        help='Stream the productivity CSV in chunks of this many rows (0 loads everything in memory)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only merge accessions not seen by a previous run, using the state in --state-dir')
+    parser.add_argument('--state-dir', default=os.getenv('MILV_STATE_DIR', state_dir),
+                        help='Directory holding the incremental watermark and running sums')
+    args = parser.parse_args()
+
+    if args.incremental:
+        daily_avg = run_incremental(args.state_dir, args.chunk_size or 100_000)
+    elif args.chunk_size > 0:
+        daily_avg = run_streaming(args.chunk_size)
+    else:
+        daily_avg = run_in_memory()
+    print(f"Filtered data saved to {above_average_dataset}")
+
+    # Plot daily trends
+    import matplotlib.pyplot as plt
+    plt.figure(figsize=(10, 6))
+    plt.plot(daily_avg.index, daily_avg.values, marker='o')
+    plt.title('Daily Average Turnaround Time')
+    plt.xlabel('Date')
+    plt.ylabel('Average Turnaround Time (Hours)')
+    plt.grid()
+    plt.savefig(trend_file)
+    print("Trend visualization saved as 'Turnaround_Time_Trend.png'")
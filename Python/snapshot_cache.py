@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+# Snapshots live next to the source files unless MILV_CACHE_DIR says otherwise
+CACHE_DIR = os.getenv('MILV_CACHE_DIR')
+HASH_CHUNK_BYTES = 1 << 20
+
+
+def file_digest(path):
+    # Content hash, only computed when size/mtime no longer match the snapshot
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def cache_dir_for(path, cache_dir=None):
+    cache_dir = cache_dir or CACHE_DIR or os.path.join(os.path.dirname(os.path.abspath(path)), '.milv_cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def _snapshot_paths(path, options, cache_dir=None):
+    cache_dir = cache_dir_for(path, cache_dir)
+    # Different read options produce different frames, so they get their own snapshot
+    options_key = hashlib.sha1(json.dumps(options, sort_keys=True, default=repr).encode()).hexdigest()[:12]
+    stem = f"{os.path.splitext(os.path.basename(path))[0]}-{options_key}"
+    return os.path.join(cache_dir, stem + '.parquet'), os.path.join(cache_dir, stem + '.json')
+
+
+def arrow_safe(df):
+    # Columns that low_memory=False leaves as mixed str/number objects cannot be written as-is
+    for col in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[col], skipna=True) not in ('string', 'empty'):
+            df[col] = df[col].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+
+def load_snapshot(path, reader, options, cache_dir=None):
+    snapshot_path, meta_path = _snapshot_paths(path, options, cache_dir)
+    stat = os.stat(path)
+
+    meta = None
+    if os.path.exists(meta_path) and os.path.exists(snapshot_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+    if meta is not None:
+        # Fast path: unchanged size and mtime means the snapshot is current
+        if meta['size'] == stat.st_size and meta['mtime_ns'] == stat.st_mtime_ns:
+            return pd.read_parquet(snapshot_path)
+        # File was touched or copied but the content is the same
+        digest = file_digest(path)
+        if meta['sha256'] == digest:
+            meta.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+            return pd.read_parquet(snapshot_path)
+    else:
+        digest = file_digest(path)
+
+    df = arrow_safe(reader(path, **options))
+    df.to_parquet(snapshot_path, index=False)
+    with open(meta_path, 'w') as f:
+        json.dump({'source': os.path.abspath(path), 'size': stat.st_size,
+                   'mtime_ns': stat.st_mtime_ns, 'sha256': digest}, f)
+    return df
+
+
+def read_csv_cached(path, cache_dir=None, **read_csv_kwargs):
+    # Drop-in for pd.read_csv that parses each source CSV once into a Parquet snapshot
+    return load_snapshot(path, pd.read_csv, read_csv_kwargs, cache_dir)
@@ -0,0 +1,133 @@
+import csv
+import sys
+from datetime import datetime
+
+import pandas as pd
+
+from snapshot_cache import load_snapshot
+
+# Declared layout of each source extract: the columns the pipeline uses, their dtypes and which
+# ones are timestamps. Loaders read only these columns, so a wide extract parses in time and memory
+# proportional to what is used rather than to its width. Required columns must be in the header;
+# optional ones are read when present. Date columns are parsed with the first candidate format
+# that matches the first data row (None lets pandas infer, same as an untyped read).
+TIMESTAMP_FORMATS = [
+    '%m/%d/%Y %I:%M:%S %p',
+    '%m/%d/%Y %I:%M %p',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y %H:%M',
+    '%m/%d/%Y',
+]
+SNIFF_LINES = 20
+
+SCHEMAS = {
+    # Productivity_with_sections.csv: one row per report section; only the join key, the
+    # finalize timestamp and the section are used
+    'productivity': {
+        'required': {'Accession': 'str', 'Finalize Time': 'str'},
+        'optional': {'Section': 'category'},
+        'dates': {'Finalize Time': TIMESTAMP_FORMATS},
+    },
+    # Volume.csv / Mammo_volume.csv: one row per exam, carrying the dashboard's filter dimensions
+    'volume': {
+        'required': {'Accession': 'str', 'End Date': 'str', 'Modality': 'category'},
+        'optional': {'Exam': 'category', 'Base Class': 'category', 'Department': 'category',
+                     'Hospital Location': 'category', 'Radiologist Group': 'category'},
+        'dates': {'End Date': TIMESTAMP_FORMATS},
+    },
+    # Merged_Turnaround.csv: processdata.py's own productivity x volume rows, re-read in chunks.
+    # Fixed dtypes keep every chunk alike; pandas writes the timestamps back in ISO form
+    'merged': {
+        'required': {'Accession': 'int64', 'End Date': 'str', 'Finalize Time': 'str', 'Modality': 'str',
+                     'Turnaround_Time_Hours': 'float64'},
+        'optional': {'Section': 'str', 'Exam': 'str', 'Base Class': 'str', 'Department': 'str',
+                     'Hospital Location': 'str', 'Radiologist Group': 'str'},
+        'dates': {'End Date': ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d'],
+                  'Finalize Time': ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d']},
+    },
+}
+
+
+def sniff_layout(path):
+    # Lines before the header row (Volume extracts have a title preamble), the header, and the first data row
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        head = [f.readline() for _ in range(SNIFF_LINES)]
+    for skiprows, line in enumerate(head):
+        row = next(csv.reader([line]), [])
+        if 'Accession' in row:
+            sample = next((r for r in csv.reader(head[skiprows + 1:]) if r), [])
+            return skiprows, row, dict(zip(row, sample))
+    raise ValueError(f"No 'Accession' header found in the first {SNIFF_LINES} lines of {path}")
+
+
+def read_header(path):
+    # Column names without parsing any data rows
+    return sniff_layout(path)[1]
+
+
+def detect_timestamp_format(value, formats=TIMESTAMP_FORMATS):
+    for fmt in formats:
+        try:
+            datetime.strptime(value.strip(), fmt)
+            return fmt
+        except ValueError:
+            continue
+    # Unknown layout: let pandas infer it, same as the old untyped path
+    return None
+
+
+def _schema(schema):
+    return SCHEMAS[schema] if isinstance(schema, str) else schema
+
+
+def read_options(path, schema):
+    # pd.read_csv arguments projecting `path` onto the schema, plus the format of each date column
+    schema = _schema(schema)
+    skiprows, header, sample = sniff_layout(path)
+    missing = [col for col in schema['required'] if col not in header]
+    if missing:
+        raise ValueError(f"{path} is missing required columns {missing}")
+    dtype = {col: kind for col, kind in {**schema['required'], **schema['optional']}.items() if col in header}
+    date_formats = {col: detect_timestamp_format(sample.get(col, ''), formats)
+                    for col, formats in schema['dates'].items() if col in dtype}
+    return {'skiprows': skiprows, 'usecols': list(dtype), 'dtype': dtype}, date_formats
+
+
+def parse_dates(frame, date_formats):
+    for col, fmt in date_formats.items():
+        frame[col] = pd.to_datetime(frame[col], format=fmt, errors='coerce')
+    return frame
+
+
+def read_source(path, schema, **read_csv_kwargs):
+    # Typed, projected pd.read_csv; pass chunksize for an iterator of parsed chunks
+    options, date_formats = read_options(path, schema)
+    reader = pd.read_csv(path, **options, **read_csv_kwargs)
+    if isinstance(reader, pd.DataFrame):
+        return parse_dates(reader, date_formats)
+    return (parse_dates(chunk, date_formats) for chunk in reader)
+
+
+def read_source_cached(path, schema, cache_dir=None):
+    # read_source behind a Parquet snapshot; the schema is part of the snapshot key, so editing it re-parses
+    return load_snapshot(path, read_source, {'schema': _schema(schema)}, cache_dir)
+
+
+def describe(path, schema):
+    # Header-only report: every column, and which of them the schema reads or is missing
+    header = read_header(path)
+    lines = [f"{path}: {len(header)} columns", f"  Columns: {header}"]
+    missing = [col for col in _schema(schema)['required'] if col not in header]
+    if missing:
+        lines.append(f"  Missing required columns: {missing}")
+    else:
+        options, date_formats = read_options(path, schema)
+        lines.append(f"  Read by the {schema} schema: {options['usecols']} (date formats: {date_formats})")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    # python source_schemas.py <schema> <file> [<schema> <file> ...]
+    args = sys.argv[1:]
+    for name, path in zip(args[::2], args[1::2]):
+        print(describe(path, name))
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+from callback_metrics import timed
+
+# Turnaround quantile sketches: each (day, modality, hospital) cell keeps counts over a fixed
+# grid of log-spaced buckets (DDSketch-style). Cells merge by adding counts, and any quantile
+# read back is within RELATIVE_ACCURACY of the exact value.
+SKETCH_DIMENSIONS = ['Date', 'Modality', 'Hospital Location']
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = np.log(GAMMA)
+MIN_VALUE = 1e-3  # Anything under ~4 seconds lands in the zero bucket
+ZERO_BUCKET = np.iinfo(np.int32).min
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def bucket_of(values):
+    values = np.asarray(values, dtype='float64')
+    buckets = np.full(values.shape, ZERO_BUCKET, dtype='int32')
+    positive = values > MIN_VALUE
+    buckets[positive] = np.ceil(np.log(values[positive]) / LOG_GAMMA).astype('int32')
+    return buckets
+
+
+def bucket_value(buckets):
+    # Midpoint (in relative terms) of each bucket's (gamma^(b-1), gamma^b] range
+    buckets = np.asarray(buckets)
+    values = 2 * np.power(GAMMA, buckets.astype('float64')) / (GAMMA + 1)
+    return np.where(buckets == ZERO_BUCKET, 0.0, values)
+
+
+def build_sketches(data, dimensions=SKETCH_DIMENSIONS):
+    # One row per non-empty (cell, bucket): the dimensions, 'bucket' and 'count'
+    dims = [col for col in dimensions if col in data.columns]
+    valid = data[data['Turnaround_Time_Hours'].notna()]
+    keys = [valid[col] for col in dims] + [pd.Series(bucket_of(valid['Turnaround_Time_Hours']),
+                                                     index=valid.index, name='bucket')]
+    return valid.groupby(keys, observed=True).size().rename('count').reset_index()
+
+
+@timed('aggregate')
+def sketch_quantiles(sketches, quantiles=QUANTILES):
+    # Merge the selected cells and read quantiles off the combined bucket counts
+    merged = sketches.groupby('bucket')['count'].sum().sort_index()
+    if merged.empty:
+        return {q: float('nan') for q in quantiles}
+    cumulative = merged.to_numpy().cumsum()
+    ranks = np.asarray(quantiles) * (cumulative[-1] - 1)
+    hits = np.searchsorted(cumulative, ranks, side='right')
+    values = bucket_value(merged.index.to_numpy()[hits])
+    return dict(zip(quantiles, values.tolist()))
+
+
+@timed('aggregate')
+def daily_quantiles(sketches, quantiles=QUANTILES):
+    # Per-day quantiles as a frame with a 'Date' column and one column per quantile
+    merged = sketches.groupby(['Date', 'bucket'], observed=True)['count'].sum().reset_index()
+    cumulative = merged.groupby('Date')['count'].cumsum()
+    total = merged.groupby('Date')['count'].transform('sum')
+    daily = pd.DataFrame(index=pd.Index(merged['Date'].unique(), name='Date'))
+    for q in quantiles:
+        first_hit = merged[cumulative > q * (total - 1)].groupby('Date')['bucket'].first()
+        daily[q] = pd.Series(bucket_value(first_hit.to_numpy()), index=first_hit.index)
+    return daily.sort_index().reset_index()
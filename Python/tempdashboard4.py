@@ -1,21 +1,34 @@
 import dash
 from dash import dcc, html, dash_table
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import plotly.express as px
-import pandas as pd
 import os
+from downsample import coarsen_heatmap, downsample, use_webgl
+from figures import build_figure
+from background_jobs import BACKGROUND_POLL_MS, PROGRESS_HIDDEN, PROGRESS_VISIBLE, job_manager
+from figure_cache import register_etags, source_version
+from callback_metrics import register_metrics
+from dashboard_data import load_dashboard_data, load_shared_dashboard_data
+from filter_index import FilterIndex
+from filtered_export import EXPORT_FORMAT_OPTIONS, export_url, register_export_route
 
 # Load data
-data_path = os.getenv('DATA_PATH', 'Above_Average_Turnaround.csv')  # Use an environment variable for the data path
-data = pd.read_csv(data_path, low_memory=False)
-data = data.loc[:, ~data.columns.str.contains('^Unnamed')]  # Drop unnecessary columns
-data['Finalize Time'] = pd.to_datetime(data['Finalize Time'])
-data['End Date'] = pd.to_datetime(data['End Date'])
-data['Date'] = data['End Date'].dt.date
+data_path = os.getenv('DATA_PATH', 'Above_Average_Turnaround')  # Use an environment variable for the data path
+# MILV_SHARED_DATA=1 (multi-worker gunicorn) maps one Arrow copy of the data into every worker
+if os.getenv('MILV_SHARED_DATA'):
+    data = load_shared_dashboard_data(data_path)
+else:
+    data = load_dashboard_data(data_path)
+data_version = source_version(data_path)
+filter_index = FilterIndex(data)
 
 # Initialize the app
 app = dash.Dash(__name__)
 app.title = "Executive Turnaround Time Dashboard"
+server = app.server  # WSGI entry point, e.g. gunicorn -w 4 tempdashboard4:server
+register_export_route(app.server, data, filter_index.positions_for)
+register_etags(app.server)
+register_metrics(app)
 
 # Layout
 app.layout = html.Div([
@@ -47,8 +60,8 @@ app.layout = html.Div([
             html.Label("Select Date Range:", style={'font-weight': 'bold'}),
             dcc.DatePickerRange(
                 id='date-picker',
-                start_date=data['Date'].min(),
-                end_date=data['Date'].max(),
+                start_date=data['Date'].min().date(),
+                end_date=data['Date'].max().date(),
                 display_format='YYYY-MM-DD',
             ),
         ], style={'margin-bottom': '20px', 'width': '48%', 'display': 'inline-block'}),
@@ -74,6 +87,9 @@ app.layout = html.Div([
         ], style={'margin-bottom': '20px', 'width': '48%', 'display': 'inline-block'}),
     ], style={'padding': '20px', 'background-color': '#f2f2f2'}),
 
+    # Progress of the background job behind the tiles and charts
+    html.Progress(id='dashboard-progress', value='0', max='4', style=PROGRESS_HIDDEN),
+
     # Visualizations Section
     html.Div([
         html.Div([
@@ -97,8 +113,15 @@ app.layout = html.Div([
 
     # Export Button
     html.Div([
+        dcc.Dropdown(
+            id='export-format',
+            options=EXPORT_FORMAT_OPTIONS,
+            value='csv',
+            clearable=False,
+            style={'width': '160px', 'display': 'inline-block', 'vertical-align': 'middle'},
+        ),
         html.Button("Download Filtered Data", id="download-button", style={'background-color': '#003366', 'color': 'white'}),
-        dcc.Download(id="download-dataframe-csv"),
+        dcc.Location(id='download-location', refresh=True),
     ], style={'text-align': 'center', 'margin-top': '20px'}),
 ])
 
@@ -113,27 +136,29 @@ app.layout = html.Div([
     [Input('date-picker', 'start_date'),
      Input('date-picker', 'end_date'),
      Input('modality-dropdown', 'value'),
-     Input('hospital-dropdown', 'value')]
+     Input('hospital-dropdown', 'value')],
+    # Long date ranges run in a worker process; a newer filter change cancels the running job
+    background=True,
+    interval=BACKGROUND_POLL_MS,
+    manager=job_manager(lambda: data_version),
+    running=[(Output('dashboard-progress', 'style'), PROGRESS_VISIBLE, PROGRESS_HIDDEN)],
+    progress=[Output('dashboard-progress', 'value'), Output('dashboard-progress', 'max')],
 )
-def update_dashboard(start_date, end_date, modalities, hospitals):
+def update_dashboard(set_progress, start_date, end_date, modalities, hospitals):
     # Filter data
-    filtered_data = data[
-        (data['Date'] >= pd.to_datetime(start_date).date()) &
-        (data['Date'] <= pd.to_datetime(end_date).date())
-    ]
-    if modalities:
-        filtered_data = filtered_data[filtered_data['Modality'].isin(modalities)]
-    if hospitals:
-        filtered_data = filtered_data[filtered_data['Hospital Location'].isin(hospitals)]
+    filtered_data = filter_index.rows(start_date, end_date, modalities, hospitals)
 
     # Summary metrics
     avg_tat = f"{filtered_data['Turnaround_Time_Hours'].mean():.2f}" if not filtered_data.empty else "N/A"
     max_tat = f"{filtered_data['Turnaround_Time_Hours'].max():.2f}" if not filtered_data.empty else "N/A"
     record_count = len(filtered_data)
+    set_progress(('1', '4'))
 
-    # Heatmap
-    heatmap_fig = px.density_heatmap(
-        filtered_data,
+    # Heatmap from per-day sums (density_heatmap sums z anyway), binned when the range is long
+    heatmap_frame = filtered_data.groupby(['Date', 'Modality'], observed=True, as_index=False)['Turnaround_Time_Hours'].sum()
+    heatmap_fig = build_figure(
+        px.density_heatmap,
+        coarsen_heatmap(heatmap_frame, 'Date', 'Modality', 'Turnaround_Time_Hours'),
         x='Date',
         y='Modality',
         z='Turnaround_Time_Hours',
@@ -141,48 +166,44 @@ def update_dashboard(start_date, end_date, modalities, hospitals):
         title="Heatmap of Turnaround Times by Modality",
         labels={'Turnaround_Time_Hours': 'Avg Turnaround Time (Hours)'},
     )
+    set_progress(('2', '4'))
 
-    # Line Chart
+    # Line Chart, thinned to the point budget for long date ranges
     daily_avg = filtered_data.groupby('Date')['Turnaround_Time_Hours'].mean().reset_index()
-    line_chart_fig = px.line(
+    daily_avg = downsample(daily_avg, 'Date', 'Turnaround_Time_Hours')
+    line_chart_fig = build_figure(
+        px.line,
         daily_avg,
         x='Date',
         y='Turnaround_Time_Hours',
         title="Daily Average Turnaround Time",
         labels={'Turnaround_Time_Hours': 'Avg Turnaround Time (Hours)'},
     )
+    set_progress(('3', '4'))
 
     # Update table data
     table_data = filtered_data.to_dict('records')
 
-    return avg_tat, max_tat, record_count, heatmap_fig, line_chart_fig, table_data
+    return avg_tat, max_tat, record_count, heatmap_fig, use_webgl(line_chart_fig), table_data
 
 @app.callback(
-    Output("download-dataframe-csv", "data"),
-    [Input("download-button", "n_clicks"),
-     Input('date-picker', 'start_date'),
-     Input('date-picker', 'end_date'),
-     Input('modality-dropdown', 'value'),
-     Input('hospital-dropdown', 'value')]
+    Output('download-location', 'href'),
+    [Input("download-button", "n_clicks")],
+    [State('date-picker', 'start_date'),
+     State('date-picker', 'end_date'),
+     State('modality-dropdown', 'value'),
+     State('hospital-dropdown', 'value'),
+     State('export-format', 'value')]
 )
-def download_filtered_data(n_clicks, start_date, end_date, modalities, hospitals):
+def download_filtered_data(n_clicks, start_date, end_date, modalities, hospitals, export_format):
     if n_clicks is None:
         return dash.no_update
 
-    # Filter data for export
-    filtered_data = data[
-        (data['Date'] >= pd.to_datetime(start_date).date()) &
-        (data['Date'] <= pd.to_datetime(end_date).date())
-    ]
-    if modalities:
-        filtered_data = filtered_data[filtered_data['Modality'].isin(modalities)]
-    if hospitals:
-        filtered_data = filtered_data[filtered_data['Hospital Location'].isin(hospitals)]
-
-    return dcc.send_data_frame(filtered_data.to_csv, "Filtered_Data.csv")
+    # Filtering and writing happen in the streaming export route, only when the button is clicked
+    return f"{export_url(start_date, end_date, modalities, hospitals, export_format)}&click={n_clicks}"
 
 # Run the app
 if __name__ == "__main__":
     from waitress import serve
     port = int(os.environ.get("PORT", 8080))
-    serve(app, host="0.0.0.0
+    serve(app, host="0.0.0.0", port=port)
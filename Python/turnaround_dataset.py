@@ -0,0 +1,103 @@
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Turnaround rows (processdata.py's above-average output and the incremental merged history)
+# as a Hive-partitioned Parquet dataset:
+#   <root>/Month=2024-01/Modality=CT/part-0-0.parquet
+# Rows are sorted by End Date before writing so each row group's min/max statistics
+# let readers skip groups outside the requested date range.
+PARTITION_COLUMNS = ['Month', 'Modality']
+DATE_COLUMNS = ['End Date', 'Finalize Time']
+# Every chunk is written with these types and any other column as strings, so a column that
+# pandas infers as numbers in one chunk and as text in the next cannot break the dataset schema
+COLUMN_TYPES = {'Accession': pa.int64(), 'End Date': pa.timestamp('ns'), 'Finalize Time': pa.timestamp('ns'),
+                'Turnaround_Time_Hours': pa.float64()}
+ROW_GROUP_ROWS = 64_000
+
+
+def _prepare(frame, columns=None):
+    # columns: lay the chunk out like the first one; extra columns are dropped, missing ones become nulls
+    frame = frame.copy() if columns is None else frame.reindex(columns=columns)
+    for col in DATE_COLUMNS:
+        if col in frame.columns:
+            frame[col] = pd.to_datetime(frame[col], errors='coerce').astype('datetime64[ns]')
+    if 'Accession' in frame.columns:
+        frame['Accession'] = pd.to_numeric(frame['Accession'], errors='coerce')
+    if 'Turnaround_Time_Hours' in frame.columns:
+        frame['Turnaround_Time_Hours'] = pd.to_numeric(frame['Turnaround_Time_Hours'], errors='coerce')
+    frame['Month'] = frame['End Date'].dt.strftime('%Y-%m').fillna('unknown')
+    frame['Modality'] = frame['Modality'].astype(str).where(frame['Modality'].notna(), 'unknown')
+    for col in frame.columns:
+        if col not in COLUMN_TYPES:
+            frame[col] = frame[col].astype(object).map(lambda v: v if pd.isna(v) else str(v))
+    return frame.sort_values('End Date', kind='stable')
+
+
+def _schema(frame):
+    return pa.schema([pa.field(col, COLUMN_TYPES.get(col, pa.string())) for col in frame.columns])
+
+
+def write_turnaround_dataset(frames, root):
+    # frames: an iterable of DataFrames (one for in-memory runs, many for chunked runs)
+    shutil.rmtree(root, ignore_errors=True)
+    return _write_frames(frames, root, 'part')
+
+
+def append_turnaround_dataset(frames, root, batch):
+    # Adds the frames as new part-<batch>-* files beside the existing partitions; nothing already
+    # written is read or rewritten. The fixed column types keep appended files schema-compatible.
+    return _write_frames(frames, root, f'part-{batch}')
+
+
+def _write_frames(frames, root, prefix):
+    schema = None
+    rows = 0
+    for part, frame in enumerate(frames):
+        if frame.empty:
+            continue
+        if schema is None:
+            frame = _prepare(frame)
+            schema = _schema(frame)
+        else:
+            frame = _prepare(frame, [col for col in schema.names if col != 'Month'])
+        table = pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+        pq.write_to_dataset(table, root, partition_cols=PARTITION_COLUMNS,
+                            basename_template=f'{prefix}-{part}-{{i}}.parquet',
+                            max_rows_per_group=ROW_GROUP_ROWS, existing_data_behavior='overwrite_or_ignore')
+        rows += len(frame)
+    return rows
+
+
+def read_turnaround_dataset(root, start_date=None, end_date=None, modalities=None, columns=None):
+    # Month/Modality prune whole directories; the End Date bounds are pushed down to row groups
+    dataset = ds.dataset(root, format='parquet', partitioning='hive')
+    expression = None
+    conditions = []
+    if start_date is not None:
+        start = pd.Timestamp(start_date).normalize()
+        conditions += [ds.field('Month') >= start.strftime('%Y-%m'), ds.field('End Date') >= start.to_pydatetime()]
+    if end_date is not None:
+        end = pd.Timestamp(end_date).normalize() + pd.Timedelta(days=1)
+        conditions += [ds.field('Month') <= pd.Timestamp(end_date).strftime('%Y-%m'),
+                       ds.field('End Date') < end.to_pydatetime()]
+    if modalities:
+        conditions.append(ds.field('Modality').isin(list(modalities)))
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+
+    if columns is not None:
+        columns = [col for col in columns if col in dataset.schema.names]
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+
+def iter_turnaround_dataset(root, min_turnaround=None, batch_rows=ROW_GROUP_ROWS):
+    # The dataset as a stream of DataFrames, optionally only rows above a turnaround cut
+    dataset = ds.dataset(root, format='parquet', partitioning='hive')
+    expression = None if min_turnaround is None else ds.field('Turnaround_Time_Hours') > min_turnaround
+    for batch in dataset.to_batches(filter=expression, batch_size=batch_rows):
+        if batch.num_rows:
+            yield batch.to_pandas()
@@ -0,0 +1,22 @@
+import pandas as pd
+
+from snapshot_cache import load_snapshot
+from source_schemas import SCHEMAS, read_source
+
+# Volume extracts come out of the RIS in two shapes:
+#   Volume.csv       - '"Volume"' title preamble, every field quoted, 12-hour '1/2/2024 1:02:00 PM'
+#   Mammo_volume.csv - header on the first line, 24-hour '1/2/2024 13:02'
+# Both are read through the 'volume' schema in source_schemas, which finds the header and the
+# timestamp format from the first lines of the file.
+
+
+def _parse_volume(path, schema):
+    df = read_source(path, schema)
+    # Rows without a usable Accession can never join to productivity, so drop them here
+    df['Accession'] = pd.to_numeric(df['Accession'], errors='coerce')
+    return df.dropna(subset=['Accession']).astype({'Accession': 'int64'}).reset_index(drop=True)
+
+
+def read_volume(path, cache_dir=None):
+    # Typed load of a Volume extract; categoricals and datetimes survive the Parquet snapshot
+    return load_snapshot(path, _parse_volume, {'schema': SCHEMAS['volume']}, cache_dir)
@@ -1,24 +1,104 @@
 import dash
-from dash import dcc, html, Input, Output
+from dash import dcc, html, Input, Output, State
 import plotly.graph_objects as go
+import os
+import sys
+import numpy as np
 import pandas as pd
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Python'))
+from downsample import WEBGL_THRESHOLD
+from background_jobs import BACKGROUND_POLL_MS, PROGRESS_HIDDEN, PROGRESS_VISIBLE, job_manager
+from figure_cache import register_etags
+from callback_metrics import register_metrics, timed
+from figures import build_figure
+
 # Initialize the Dash app
 app = dash.Dash(__name__)
 app.title = "MILV Ops Dashboard POC/MVP v1"
+register_etags(app.server)
+register_metrics(app)
 
 # Load your data
-file_path = 'C:/Users/aliso/OneDrive/Desktop/Cleaned_Operational_Data.csv'  # Update this path with the correct file path
-data = pd.read_csv(file_path)
+file_path = os.getenv('MILV_OPS_CSV', 'C:/Users/aliso/OneDrive/Desktop/Cleaned_Operational_Data.csv')  # Update this path with the correct file path
+
+INDEXED_COLUMNS = ['Dr', 'FY25 Employment', 'Category', 'Subcategory']
+ROLLUP_KEYS = ['FY25 Employment', 'Category', 'Subcategory']
+
+
+def sorted_values(column):
+    return sorted(column.dropna().unique().tolist(), key=str)
+
+
+def load_ops_data():
+    # (Re)load the CSV and rebuild everything derived from it together
+    global data, numerical_columns, row_index, employment_rollup, option_hierarchy, loaded_mtime
+    loaded_mtime = os.stat(file_path).st_mtime_ns
+    data = pd.read_csv(file_path)
+
+    # Remove columns with "Unnamed" in their name
+    data = data.loc[:, ~data.columns.str.contains('^Unnamed')]
+    numerical_columns = data.select_dtypes(include='number').columns
+
+    # Sorted row positions for every value of the filter columns
+    row_index = {col: data.groupby(col, sort=False).indices for col in INDEXED_COLUMNS}
+
+    # Numeric totals per Employment x Category x Subcategory; NaN keys kept so unfiltered totals match
+    employment_rollup = data.groupby(ROLLUP_KEYS, dropna=False)[list(numerical_columns)].sum().reset_index()
 
-# Remove columns with "Unnamed" in their name
-data = data.loc[:, ~data.columns.str.contains('^Unnamed')]
+    # Cascading dropdown hierarchy with pre-sorted option values, versioned by the source mtime
+    option_hierarchy = {
+        'version': loaded_mtime,
+        'employment': sorted_values(data['FY25 Employment']),
+        'categories': sorted_values(data['Category']),
+        'all_doctors': sorted_values(data['Dr']),
+        'all_subcategories': sorted_values(data['Subcategory']),
+        'doctors_by_employment': {str(emp): sorted_values(group) for emp, group in data.groupby('FY25 Employment')['Dr']},
+        'subcategories_by_category': {str(cat): sorted_values(group) for cat, group in data.groupby('Category')['Subcategory']},
+    }
 
-# Prepare unique values for filtering
-unique_employment_types = data['FY25 Employment'].unique()
-unique_categories = data['Category'].unique()
-unique_subcategories = data['Subcategory'].unique()
-numerical_columns = data.select_dtypes(include='number').columns
+
+def refresh_if_changed():
+    if os.stat(file_path).st_mtime_ns != loaded_mtime:
+        load_ops_data()
+
+
+def data_version():
+    # Cache key for figures; reloading first means a changed CSV never serves stale figures
+    refresh_if_changed()
+    return loaded_mtime
+
+
+load_ops_data()
+
+
+@timed('filter')
+def positions_for(column, values, within=None):
+    # Sorted positions of the selected values' rows, restricted to a boolean row mask (None: every row).
+    # Costs only the matched rows, so one call per selected doctor stays cheap however large the data is
+    parts = [row_index[column][value] for value in values if value in row_index[column]]
+    if len(parts) == 1:
+        matched = parts[0]
+    else:
+        matched = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.intp)
+    return matched if within is None else matched[within[matched]]
+
+
+@timed('filter')
+def mask_for(column, values, within=None):
+    # Boolean row mask of the selected values, combined with an existing mask
+    mask = np.zeros(len(data), dtype=bool)
+    mask[positions_for(column, values)] = True
+    return mask if within is None else mask & within
+
+
+@timed('figure')
+def make_trace(chart_type, x, y, name):
+    # Line/Scatter traces switch to WebGL once they carry more points than SVG draws smoothly
+    if chart_type in ('Line', 'Scatter'):
+        trace_type = go.Scattergl if len(x) > WEBGL_THRESHOLD else go.Scatter
+        return trace_type(x=x, y=y, name=name, mode='lines+markers' if chart_type == 'Line' else 'markers')
+    return go.Bar(x=x, y=y, name=name)
 
 # Main layout of the dashboard
 app.layout = html.Div(
@@ -31,7 +111,7 @@ app.layout = html.Div(
             html.Label("Filter by Employment Type:"),
             dcc.Dropdown(
                 id='employment-filter',
-                options=[{'label': emp, 'value': emp} for emp in unique_employment_types],
+                options=[{'label': emp, 'value': emp} for emp in option_hierarchy['employment']],
                 multi=True
             ),
 
@@ -44,7 +124,7 @@ app.layout = html.Div(
             html.Label("Filter by Category:"),
             dcc.Dropdown(
                 id='category-filter',
-                options=[{'label': cat, 'value': cat} for cat in unique_categories],
+                options=[{'label': cat, 'value': cat} for cat in option_hierarchy['categories']],
                 multi=True
             ),
 
@@ -73,36 +153,60 @@ app.layout = html.Div(
             )
         ], style={'marginBottom': '20px'}),
 
-        # Display the graph
-        html.Div(id='graph-output')
+        # Display the graph, with a progress bar while it is computed in the background
+        html.Progress(id='graph-progress', value='0', max='1', style=PROGRESS_HIDDEN),
+        html.Div(id='graph-output'),
+
+        # Option hierarchy kept in localStorage, so returning sessions skip the download
+        dcc.Store(id='option-hierarchy', storage_type='local')
     ]
 )
 
-# Callback to update doctor options based on selected employment type
+# Send the hierarchy only when the browser's copy is missing or from an older data load
 @app.callback(
+    Output('option-hierarchy', 'data'),
+    [Input('option-hierarchy', 'modified_timestamp')],
+    [State('option-hierarchy', 'data')]
+)
+def sync_option_hierarchy(_, stored_hierarchy):
+    refresh_if_changed()
+    if stored_hierarchy and stored_hierarchy.get('version') == option_hierarchy['version']:
+        return dash.no_update
+    return option_hierarchy
+
+# Cascading options are set unions over the cached hierarchy, computed in the browser
+CASCADE_OPTIONS_JS = """
+function(selected, hierarchy) {
+    if (!hierarchy) {
+        return window.dash_clientside.no_update;
+    }
+    var values = hierarchy['%(all)s'];
+    if (selected && selected.length) {
+        var union = new Set();
+        selected.forEach(function(key) {
+            (hierarchy['%(mapping)s'][String(key)] || []).forEach(function(value) { union.add(value); });
+        });
+        values = Array.from(union).sort();
+    }
+    return values.map(function(value) { return {'label': value, 'value': value}; });
+}
+"""
+
+# Doctor options follow the selected employment types
+app.clientside_callback(
+    CASCADE_OPTIONS_JS % {'all': 'all_doctors', 'mapping': 'doctors_by_employment'},
     Output('doctor-filter', 'options'),
-    [Input('employment-filter', 'value')]
+    [Input('employment-filter', 'value'),
+     Input('option-hierarchy', 'data')]
 )
-def update_doctor_options(selected_employment):
-    if selected_employment:
-        filtered_data = data[data['FY25 Employment'].isin(selected_employment)]
-        doctors = filtered_data['Dr'].unique()
-    else:
-        doctors = data['Dr'].unique()
-    return [{'label': doc, 'value': doc} for doc in doctors]
 
-# Callback to update subcategory options based on selected category
-@app.callback(
+# Subcategory options follow the selected categories
+app.clientside_callback(
+    CASCADE_OPTIONS_JS % {'all': 'all_subcategories', 'mapping': 'subcategories_by_category'},
     Output('subcategory-filter', 'options'),
-    [Input('category-filter', 'value')]
+    [Input('category-filter', 'value'),
+     Input('option-hierarchy', 'data')]
 )
-def update_subcategory_options(selected_categories):
-    if selected_categories:
-        filtered_data = data[data['Category'].isin(selected_categories)]
-        subcategories = filtered_data['Subcategory'].unique()
-    else:
-        subcategories = data['Subcategory'].unique()
-    return [{'label': subcat, 'value': subcat} for subcat in subcategories]
 
 # Callback to update the graph with conditional aggregation
 @app.callback(
@@ -112,51 +216,69 @@ def update_subcategory_options(selected_categories):
      Input('category-filter', 'value'),
      Input('subcategory-filter', 'value'),
      Input('value-selector', 'value'),
-     Input('chart-type-selector', 'value')]
+     Input('chart-type-selector', 'value')],
+    # Runs in a worker process so slow selections don't hold a Waitress thread; a newer
+    # selection cancels the running job, and finished figures are reused until the CSV changes
+    background=True,
+    interval=BACKGROUND_POLL_MS,
+    manager=job_manager(data_version),
+    running=[(Output('graph-progress', 'style'), PROGRESS_VISIBLE, PROGRESS_HIDDEN)],
+    progress=[Output('graph-progress', 'value'), Output('graph-progress', 'max')],
 )
-def update_graph(selected_employment, selected_doctors, selected_categories, selected_subcategories, selected_values, chart_type):
-    # Copy the data for filtering
-    filtered_data = data.copy()
+def update_graph(set_progress, selected_employment, selected_doctors, selected_categories, selected_subcategories, selected_values, chart_type):
+    refresh_if_changed()
+
+    # Resolve the filters to one boolean row mask through the index; None means no filter
+    filtered_rows = None
     
     # Filter by employment type if selected
     if selected_employment:
-        filtered_data = filtered_data[filtered_data['FY25 Employment'].isin(selected_employment)]
+        filtered_rows = mask_for('FY25 Employment', selected_employment, filtered_rows)
     
     # Filter by category if selected
     if selected_categories:
-        filtered_data = filtered_data[filtered_data['Category'].isin(selected_categories)]
+        filtered_rows = mask_for('Category', selected_categories, filtered_rows)
     
     # Filter by subcategory if selected
     if selected_subcategories:
-        filtered_data = filtered_data[filtered_data['Subcategory'].isin(selected_subcategories)]
+        filtered_rows = mask_for('Subcategory', selected_subcategories, filtered_rows)
 
     # Check if values are selected for the graph
     if not selected_values:
         return html.Div("Please select values to display on the graph.", style={'textAlign': 'center', 'color': 'red'})
 
     # Create the graph figure
-    figure = go.Figure()
+    figure = build_figure(go.Figure)
 
     # If doctors are selected, display data per doctor
     if selected_doctors:
-        for doctor in selected_doctors:
-            doctor_data = filtered_data[filtered_data['Dr'] == doctor]
-            for value in selected_values:
-                if value in doctor_data.columns:
-                    figure.add_trace(go.Bar(x=doctor_data['Subcategory'], y=doctor_data[value], name=f"{doctor} - {value}"))
+        plotted_values = [value for value in selected_values if value in data.columns]
+        for done, doctor in enumerate(selected_doctors):
+            set_progress((str(done), str(len(selected_doctors))))
+            # Direct slice of this doctor's filtered rows, only the plotted columns
+            doctor_data = data.iloc[positions_for('Dr', [doctor], filtered_rows)][['Subcategory'] + plotted_values]
+            for value in plotted_values:
+                build_figure(figure.add_trace, make_trace(chart_type, doctor_data['Subcategory'], doctor_data[value], f"{doctor} - {value}"))
     else:
         # If no specific doctors are selected, aggregate by 'FY25 Employment'
         if selected_employment:
-            aggregated_data = filtered_data.groupby('FY25 Employment', as_index=False).sum()
+            # Sum the few matching roll-up rows instead of regrouping the raw data
+            rollup = employment_rollup[employment_rollup['FY25 Employment'].isin(selected_employment)]
+            if selected_categories:
+                rollup = rollup[rollup['Category'].isin(selected_categories)]
+            if selected_subcategories:
+                rollup = rollup[rollup['Subcategory'].isin(selected_subcategories)]
+            aggregated_data = rollup.groupby('FY25 Employment', as_index=False)[list(numerical_columns)].sum()
             for value in selected_values:
                 if value in aggregated_data.columns:
-                    figure.add_trace(go.Bar(x=aggregated_data['FY25 Employment'], y=aggregated_data[value], name=value))
+                    build_figure(figure.add_trace, make_trace(chart_type, aggregated_data['FY25 Employment'], aggregated_data[value], value))
         else:
             # Prompt to select an option if nothing is selected
             return html.Div("Please select either doctors or an employment type for comparison.", style={'textAlign': 'center', 'color': 'red'})
 
     # Update the figure layout
-    figure.update_layout(
+    build_figure(
+        figure.update_layout,
         title="Comparison of wRVU Values",
         xaxis_title="Subcategory" if selected_doctors else "Employment Type",
         yaxis_title="Values",
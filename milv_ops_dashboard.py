@@ -3,13 +3,57 @@ from dash import dcc, html
 from dash.dependencies import Input, Output
 import plotly.express as px
 import pandas as pd
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Python'))
+from excel_cache import read_excel_cached
+from figure_cache import figure_cache, register_etags, source_version
+from callback_metrics import register_metrics, timed
+from figures import build_figure
 
 # Load the data
-file_path = '/path/to/your/alison-ops-analysisv3.xlsx'  # Update with the correct path
-data = pd.read_excel(file_path, sheet_name='alison-ops-analysis')
+file_path = os.getenv('MILV_OPS_WORKBOOK', '/path/to/your/alison-ops-analysisv3.xlsx')  # Update with the correct path
+data = read_excel_cached(file_path, sheet_name='alison-ops-analysis')  # Parquet snapshot per sheet, rebuilt when the workbook changes
+data_version = source_version(file_path)
+
+# Fiscal-year columns are discovered by name ('Total wRVU FY24', 'CF FY23', ...), so new years need no code changes;
+# partial-year FYTD columns are left out of the trends
+FY_COLUMN = re.compile(r'^(?P<metric>Total wRVU|Total Payments|CF)\s+(?P<fiscal_year>FY\s*\d{2})\s*$', re.IGNORECASE)
+METRIC_NAMES = {'total wrvu': 'Total WRVU', 'total payments': 'Total Payments', 'cf': 'CF'}
+AVERAGED_METRICS = {'CF'}  # Conversion factors are rates, so they are averaged rather than summed
+
+
+def build_fiscal_year_model(data):
+    # Wide workbook -> long (Dr, Category, metric, fiscal_year, value)
+    fy_columns = {col: FY_COLUMN.match(str(col)) for col in data.columns}
+    fy_columns = {col: match for col, match in fy_columns.items() if match}
+    fiscal_data = data.melt(id_vars=['Dr', 'Category'], value_vars=list(fy_columns), var_name='column')
+    fiscal_data['metric'] = fiscal_data['column'].map(
+        {col: METRIC_NAMES[match['metric'].lower()] for col, match in fy_columns.items()})
+    fiscal_data['fiscal_year'] = fiscal_data['column'].map(
+        {col: re.sub(r'\s+', '', match['fiscal_year']).upper() for col, match in fy_columns.items()})
+    fiscal_data['value'] = pd.to_numeric(fiscal_data['value'], errors='coerce')
+    return fiscal_data.drop(columns='column')
+
+
+def build_metric_series(fiscal_data):
+    # (metric, Dr) -> Category x fiscal_year sums and counts, so callbacks only add up a few small rows
+    pivots = {aggfunc: fiscal_data.pivot_table(index=['metric', 'Dr', 'Category'], columns='fiscal_year',
+                                               values='value', aggfunc=aggfunc).sort_index(axis=1)
+              for aggfunc in ('sum', 'count')}
+    return {key: (frame.droplevel([0, 1]), pivots['count'].loc[frame.index].droplevel([0, 1]))
+            for key, frame in pivots['sum'].groupby(level=['metric', 'Dr'])}
+
+
+fiscal_data = build_fiscal_year_model(data)
+metric_series = build_metric_series(fiscal_data)
 
 # Create a Dash app
 app = dash.Dash(__name__)
+register_etags(app.server)
+register_metrics(app)
 
 # Extract unique values for multi-selection
 providers = data['Dr'].unique()
@@ -44,6 +88,23 @@ app.layout = html.Div([
     dcc.Graph(id='cf-trend-graph')
 ], style={'max-width': '1200px', 'margin': 'auto'})
 
+@timed('aggregate')
+def metric_trend(metric, selected_providers, selected_categories):
+    # One row per (provider, fiscal year) summed over the selected categories
+    rows = []
+    for provider in selected_providers or []:
+        series = metric_series.get((metric, provider))
+        if series is None:
+            continue
+        sums, counts = series
+        categories = sums.index.intersection(selected_categories or [])
+        totals = sums.loc[categories].sum(min_count=1)
+        if metric in AVERAGED_METRICS:
+            totals = totals / counts.loc[categories].sum()
+        rows += [(provider, fiscal_year, value) for fiscal_year, value in totals.items()]
+    return pd.DataFrame(rows, columns=['Dr', 'Fiscal Year', 'value'])
+
+
 # Define callback functions
 @app.callback(
     [Output('wrvu-trend-graph', 'figure'),
@@ -52,43 +113,26 @@ app.layout = html.Div([
     [Input('provider-dropdown', 'value'),
      Input('category-dropdown', 'value')]
 )
+@figure_cache.cached('milv_ops_dashboard.update_graphs', version=lambda: data_version)
 def update_graphs(selected_providers, selected_categories):
-    # Filter data based on multi-selections
-    filtered_data = data[data['Dr'].isin(selected_providers) & data['Category'].isin(selected_categories)]
-    
-    # Create WRVU trend graph
-    wrvu_fig = px.line(
-        filtered_data,
-        x=['Total WRVU FY22', 'Total WRVU FY23', 'Total WRVU FY24'],
-        y=filtered_data[['Total WRVU FY22', 'Total WRVU FY23', 'Total WRVU FY24']].values.flatten(),
-        labels={'x': 'Fiscal Year', 'y': 'Total WRVU'},
-        title='Total WRVU Trend',
-        markers=True
-    )
-    wrvu_fig.update_layout(title_font_size=18, font_family="Arial, sans-serif")
-    
-    # Create Payments trend graph
-    payments_fig = px.line(
-        filtered_data,
-        x=['Total Payments FY22', 'Total Payments FY23', 'Total Payments FY24'],
-        y=filtered_data[['Total Payments FY22', 'Total Payments FY23', 'Total Payments FY24']].values.flatten(),
-        labels={'x': 'Fiscal Year', 'y': 'Total Payments ($)'},
-        title='Total Payments Trend',
-        markers=True
-    )
-    payments_fig.update_layout(title_font_size=18, font_family="Arial, sans-serif")
-    
-    # Create CF (Conversion Factor) trend graph
-    cf_fig = px.line(
-        filtered_data,
-        x=['CF FY22', 'CF FY23', 'CF FY24'],
-        y=filtered_data[['CF FY22', 'CF FY23', 'CF FY24']].values.flatten(),
-        labels={'x': 'Fiscal Year', 'y': 'Conversion Factor (CF)'},
-        title='Conversion Factor Trend',
-        markers=True
-    )
-    cf_fig.update_layout(title_font_size=18, font_family="Arial, sans-serif")
-    
+    figures = []
+    for metric, y_label, title in [('Total WRVU', 'Total WRVU', 'Total WRVU Trend'),
+                                   ('Total Payments', 'Total Payments ($)', 'Total Payments Trend'),
+                                   ('CF', 'Conversion Factor (CF)', 'Conversion Factor Trend')]:
+        fig = build_figure(
+            px.line,
+            metric_trend(metric, selected_providers, selected_categories),
+            x='Fiscal Year',
+            y='value',
+            color='Dr',
+            labels={'value': y_label},
+            title=title,
+            markers=True
+        )
+        build_figure(fig.update_layout, title_font_size=18, font_family="Arial, sans-serif")
+        figures.append(fig)
+
+    wrvu_fig, payments_fig, cf_fig = figures
     return wrvu_fig, payments_fig, cf_fig
 
 # Run the app on port 8080